@@ -0,0 +1,107 @@
+import os
+
+from fastapi import HTTPException
+from sqlalchemy import case, func, select, union_all
+from sqlalchemy.orm import Session
+
+from . import models, database
+from .cache import TTLCache
+
+PERMISSION_CACHE_SIZE = int(os.getenv("PERMISSION_CACHE_SIZE", 10000))
+PERMISSION_CACHE_TTL = float(os.getenv("PERMISSION_CACHE_TTL", 30))
+
+# ---------- Role capabilities ----------
+CAN_VIEW = 1
+CAN_EDIT = 2
+CAN_DELETE = 4
+CAN_SHARE = 8
+
+ROLE_MASKS = {
+    models.RoleEnum.owner: CAN_VIEW | CAN_EDIT | CAN_DELETE | CAN_SHARE,
+    models.RoleEnum.editor: CAN_VIEW | CAN_EDIT,
+    models.RoleEnum.viewer: CAN_VIEW,
+}
+ROLE_RANKS = {models.RoleEnum.viewer: 1, models.RoleEnum.editor: 2, models.RoleEnum.owner: 3}
+
+# ---------- Cache keyed on (user_id, event_id) ----------
+cache = TTLCache(PERMISSION_CACHE_SIZE, PERMISSION_CACHE_TTL)
+
+def invalidate(user_id: int, event_id: int):
+    cache.pop((user_id, event_id))
+
+def invalidate_event(event_id: int):
+    cache.discard_where(lambda key, _: key[1] == event_id)
+
+def invalidate_events(event_ids):
+    event_ids = set(event_ids)
+    cache.discard_where(lambda key, _: key[1] in event_ids)
+
+def invalidate_users(user_ids):
+    user_ids = set(user_ids)
+    cache.discard_where(lambda key, _: key[0] in user_ids)
+
+# ---------- Grants: direct permissions plus group shares ----------
+def grants(user_id: int, event_ids=None, with_role: bool = True):
+    # (event_id, role) for every way user_id reaches an event; an event reached twice appears twice
+    Permission, GroupPermission, GroupMember = models.Permission, models.GroupPermission, models.GroupMember
+    direct = select(Permission.event_id, *([Permission.role] if with_role else [])).where(Permission.user_id == user_id)
+    via_groups = (
+        select(GroupPermission.event_id, *([GroupPermission.role] if with_role else []))
+        .join(GroupMember, GroupMember.group_id == GroupPermission.group_id)
+        .where(GroupMember.user_id == user_id)
+    )
+    if event_ids is not None:
+        direct = direct.where(Permission.event_id.in_(event_ids))
+        via_groups = via_groups.where(GroupPermission.event_id.in_(event_ids))
+    return union_all(direct, via_groups)
+
+def visible_event_ids(user_id: int, role=None):
+    # Semi-join target for "events the user can see"; with a role, the events where it is the user's strongest one
+    if role is None:
+        return grants(user_id, with_role=False)
+    granted = grants(user_id).subquery()
+    # Comparisons (not case(value=...)) so the role literals bind through the Enum type
+    rank = func.max(case(*((granted.c.role == name, value) for name, value in ROLE_RANKS.items())))
+    return select(granted.c.event_id).group_by(granted.c.event_id).having(rank == ROLE_RANKS[role])
+
+def audience(event_ids):
+    # Users who can see any of the events, directly or through a group
+    GroupPermission, GroupMember = models.GroupPermission, models.GroupMember
+    return union_all(
+        select(models.Permission.user_id).where(models.Permission.event_id.in_(event_ids)),
+        select(GroupMember.user_id)
+        .join(GroupPermission, GroupPermission.group_id == GroupMember.group_id)
+        .where(GroupPermission.event_id.in_(event_ids)),
+    )
+
+# ---------- Resolution ----------
+def get_role_mask(db: Session, user_id: int, event_id: int) -> int:
+    mask = cache.get((user_id, event_id))
+    if mask is not None:
+        return mask
+    generation = cache.generation
+    mask = 0
+    for _, role in db.execute(grants(user_id, [event_id])):
+        mask |= ROLE_MASKS[role]
+    # A replica may lag an invalidation that already happened, so only the primary fills the cache
+    if not database.is_replica(db):
+        cache.set((user_id, event_id), mask, generation)
+    return mask
+
+def get_role_masks(db: Session, user_id: int, event_ids) -> dict:
+    # One query for a whole batch; ids without a permission map to 0
+    generation = cache.generation
+    masks = dict.fromkeys(event_ids, 0)
+    for event_id, role in db.execute(grants(user_id, list(masks))):
+        masks[event_id] |= ROLE_MASKS[role]
+    # Same rule as get_role_mask: replica reads are not cached
+    if not database.is_replica(db):
+        for event_id, mask in masks.items():
+            cache.set((user_id, event_id), mask, generation)
+    return masks
+
+def require(db: Session, user_id: int, event_id: int, capability: int, detail: str = "Permission denied") -> int:
+    mask = get_role_mask(db, user_id, event_id)
+    if not mask & capability:
+        raise HTTPException(status_code=403, detail=detail)
+    return mask
@@ -0,0 +1,221 @@
+import logging
+import math
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+from fastapi import Depends, HTTPException, Request
+from starlette.concurrency import run_in_threadpool
+
+# Rates are "<count>/<period>", period in seconds or second|minute|hour; empty turns the limit off.
+# The bucket holds <count> tokens, so a client may burst that many requests and then gets the average rate.
+RATE_LIMIT_AUTH = os.getenv("RATE_LIMIT_AUTH", "30/minute")    # register/login, per client IP
+RATE_LIMIT_BULK = os.getenv("RATE_LIMIT_BULK", "60/minute")    # batch writes, import, export, per user
+# Bulk requests running at once on one route, per worker; the rest get 503 instead of queueing
+BULK_CONCURRENCY = int(os.getenv("BULK_CONCURRENCY", 4))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 1000))
+# Batch create is the bulk-ingest path (COPY from BATCH_COPY_THRESHOLD events up), so it has its own, higher cap
+BATCH_CREATE_MAX_ITEMS = int(os.getenv("BATCH_CREATE_MAX_ITEMS", 10000))
+# "memory" limits each worker separately; "sqlite" keeps the buckets in a file every worker on the host shares
+RATE_LIMIT_STORE = os.getenv("RATE_LIMIT_STORE", "memory").lower()
+RATE_LIMIT_SQLITE_PATH = os.getenv("RATE_LIMIT_SQLITE_PATH", os.path.join(tempfile.gettempdir(), "event-rate-limits.db"))
+BUSY_RETRY_AFTER = 1
+PRUNE_EVERY = 1000
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600}
+
+logger = logging.getLogger(__name__)
+
+def parse_rate(spec: str) -> Optional[Tuple[float, float]]:
+    # "30/minute" -> (0.5 tokens per second, burst of 30)
+    if not spec or not spec.strip():
+        return None
+    count, _, period = spec.strip().partition("/")
+    period = period.strip().lower() or "second"
+    seconds = PERIODS.get(period.rstrip("s"), None) or float(period)
+    count = float(count)
+    return (count / seconds, count) if count > 0 else None
+
+# ---------- Token buckets ----------
+def _take(tokens: float, updated: float, rate: float, burst: float, now: float) -> Tuple[float, float]:
+    # Returns the tokens left and 0, or the unchanged tokens and the seconds until one is available
+    tokens = min(burst, tokens + (now - updated) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0.0
+    return tokens, (1 - tokens) / rate
+
+class MemoryStore:
+    blocking = False
+
+    def __init__(self):
+        self._buckets: Dict[str, Tuple[float, float, float]] = {}
+        self._lock = threading.Lock()
+        self._calls = 0
+
+    def take(self, key: str, rate: float, burst: float) -> float:
+        now = time.time()
+        with self._lock:
+            tokens, updated, _ = self._buckets.get(key, (burst, now, now))
+            tokens, wait = _take(tokens, updated, rate, burst, now)
+            # A bucket past full_at is the same as a missing one, so it can be dropped
+            self._buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+            self._calls += 1
+            if self._calls % PRUNE_EVERY == 0:
+                for stale in [key for key, bucket in self._buckets.items() if bucket[2] <= now]:
+                    del self._buckets[stale]
+            return wait
+
+    def size(self) -> int:
+        return len(self._buckets)
+
+class SqliteStore:
+    # One small SQLite file (put it on tmpfs, e.g. /dev/shm, to keep it in memory) shared by the host's
+    # workers. BEGIN IMMEDIATE serializes the read-modify-write of a bucket across processes.
+    blocking = True
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._calls = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL, full_at REAL)")
+            self._local.conn = conn
+        return conn
+
+    def take(self, key: str, rate: float, burst: float) -> float:
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens, wait = _take(*(row or (burst, now)), rate, burst, now)
+            conn.execute(
+                "INSERT INTO buckets (key, tokens, updated, full_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated, full_at = excluded.full_at",
+                (key, tokens, now, now + (burst - tokens) / rate),
+            )
+            self._calls += 1
+            if self._calls % PRUNE_EVERY == 0:
+                conn.execute("DELETE FROM buckets WHERE full_at <= ?", (now,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+    def size(self) -> int:
+        return self._connection().execute("SELECT count(*) FROM buckets").fetchone()[0]
+
+store = SqliteStore(RATE_LIMIT_SQLITE_PATH) if RATE_LIMIT_STORE == "sqlite" else MemoryStore()
+
+# ---------- Policies ----------
+class Policy:
+    def __init__(self, name: str, rate: Optional[Tuple[float, float]], concurrency: int):
+        self.name = name
+        self.rate = rate
+        self.concurrency = concurrency
+        # route template -> requests in flight
+        self.inflight: Dict[str, int] = {}
+        self.admitted = 0
+        self.limited = 0
+        self.busy = 0
+
+    async def check_rate(self, identity: str):
+        if self.rate is None:
+            return
+        rate, burst = self.rate
+        key = f"{self.name}:{identity}"
+        try:
+            wait = await run_in_threadpool(store.take, key, rate, burst) if store.blocking else store.take(key, rate, burst)
+        except sqlite3.Error:
+            # A limiter outage should not become an API outage
+            logger.warning("rate limit store unavailable; admitting %s", key, exc_info=True)
+            return
+        if wait:
+            self.limited += 1
+            raise HTTPException(status_code=429, detail="Too many requests", headers={"Retry-After": str(math.ceil(wait))})
+
+    @contextmanager
+    def slot(self, route: str):
+        running = self.inflight.get(route, 0)
+        if self.concurrency and running >= self.concurrency:
+            self.busy += 1
+            raise HTTPException(status_code=503, detail="Server busy, try again shortly", headers={"Retry-After": str(BUSY_RETRY_AFTER)})
+        self.inflight[route] = running + 1
+        self.admitted += 1
+        try:
+            yield
+        finally:
+            self.inflight[route] -= 1
+
+    def stats(self) -> dict:
+        return {
+            "rate_per_second": self.rate[0] if self.rate else None,
+            "burst": self.rate[1] if self.rate else None,
+            "concurrency": self.concurrency or None,
+            "inflight": {route: count for route, count in self.inflight.items() if count},
+            "admitted": self.admitted,
+            "limited": self.limited,
+            "busy": self.busy,
+        }
+
+policies: Dict[str, Policy] = {}
+
+def _route(request: Request) -> str:
+    route = request.scope.get("route")
+    return getattr(route, "path", None) or request.url.path
+
+def client_ip(request: Request) -> str:
+    # Behind a proxy, run uvicorn with --proxy-headers / --forwarded-allow-ips so this is the real client
+    return request.client.host if request.client else "unknown"
+
+def limit(name: str, rate: str, concurrency: int = 0, principal=None):
+    # Builds a route dependency that sheds load before the handler runs: 429 once the caller's bucket
+    # is empty, 503 once `concurrency` requests are already running on the route. Buckets are keyed by
+    # the principal's user id when a principal dependency is given, by client IP otherwise.
+    policy = policies[name] = Policy(name, parse_rate(rate), concurrency)
+
+    if principal is None:
+        async def admit(request: Request):
+            await policy.check_rate(client_ip(request))
+            with policy.slot(_route(request)):
+                yield
+    else:
+        async def admit(request: Request, current_user=Depends(principal)):
+            await policy.check_rate(f"user:{current_user.id}")
+            with policy.slot(_route(request)):
+                yield
+
+    return Depends(admit)
+
+def max_items(limit: int, field: Optional[str] = None):
+    # Route dependency capping a JSON list body (or the list in one of its fields). FastAPI decodes the
+    # body before solving dependencies but validates it after, so an oversized batch is refused before
+    # any item is turned into a model; request.json() returns the already decoded body.
+    async def check_size(request: Request):
+        if not await request.body():
+            return
+        try:
+            body = await request.json()
+        except ValueError:
+            # Not JSON; body validation reports it
+            return
+        items = body.get(field) if field is not None and isinstance(body, dict) else body
+        if isinstance(items, list) and len(items) > limit:
+            raise HTTPException(status_code=413, detail=f"At most {limit} items per request")
+
+    return Depends(check_size)
+
+async def stats() -> dict:
+    buckets = await run_in_threadpool(store.size) if store.blocking else store.size()
+    return {"store": RATE_LIMIT_STORE, "buckets": buckets, "policies": {name: policy.stats() for name, policy in policies.items()}}
@@ -1,40 +1,93 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Request, Body
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
 from jose import JWTError
-from . import models, schemas, database, utils
-from datetime import timedelta
+from . import models, schemas, database, utils, admission, hashing, revocation
+from .cache import TTLCache
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+import hashlib
+import os
+import time
 
 router = APIRouter(prefix="/api/auth", tags=["Authentication"])
+
+# bcrypt makes these the cheapest way to burn server CPU, so they are limited per client IP
+auth_limit = admission.limit("auth", admission.RATE_LIMIT_AUTH)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 
-def get_db():
-    db = database.SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", 10000))
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", 300))
+
+# Slim authenticated user; handlers only need the id and username
+@dataclass(frozen=True)
+class Principal:
+    id: int
+    username: str
+    claims: dict = field(default_factory=dict, repr=False, compare=False)
+
+# Keyed by token hash, entries never outlive the token's exp
+principal_cache = TTLCache(PRINCIPAL_CACHE_SIZE, PRINCIPAL_CACHE_TTL)
+
+def _token_key(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def invalidate_user(user_id: int):
+    principal_cache.discard_where(lambda _, principal: principal.id == user_id)
+
+@event.listens_for(models.User, "after_update")
+@event.listens_for(models.User, "after_delete")
+def _user_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault("changed_user_ids", set()).add(target.id)
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_changed_users(session):
+    for user_id in session.info.pop("changed_user_ids", ()):
+        invalidate_user(user_id)
 
 # -------- Register --------
-@router.post("/register", response_model=schemas.UserOut)
-def register(user_data: schemas.UserCreate, db: Session = Depends(get_db)):
+def _check_user_available(db: Session, user_data: schemas.UserCreate):
     if db.query(models.User).filter(models.User.username == user_data.username).first():
         raise HTTPException(status_code=400, detail="Username already exists")
     if db.query(models.User).filter(models.User.email == user_data.email).first():
         raise HTTPException(status_code=400, detail="Email already exists")
-    hashed_pw = utils.hash_password(user_data.password)
+
+def _create_user(db: Session, user_data: schemas.UserCreate, hashed_pw: str) -> models.User:
     user = models.User(username=user_data.username, email=user_data.email, hashed_password=hashed_pw)
     db.add(user)
     db.commit()
     db.refresh(user)
     return user
 
+# Hashing is awaited between the two DB steps so no thread or connection is held while bcrypt runs
+@router.post("/register", response_model=schemas.UserOut, dependencies=[auth_limit])
+async def register(user_data: schemas.UserCreate, db=Depends(database.get_db)):
+    await db.run_sync(_check_user_available, user_data)
+    hashed_pw = await hashing.hash_password(user_data.password)
+    return await db.run_sync(_create_user, user_data, hashed_pw)
+
 # -------- Login --------
-@router.post("/login", response_model=dict)
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.username == form_data.username).first()
-    if not user or not utils.verify_password(form_data.password, user.hashed_password):
+def _get_user(db: Session, username: str):
+    return db.query(models.User).filter(models.User.username == username).first()
+
+def _update_password_hash(db: Session, user: models.User, hashed_pw: str):
+    user.hashed_password = hashed_pw
+    db.commit()
+
+@router.post("/login", response_model=dict, dependencies=[auth_limit])
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db=Depends(database.get_db)):
+    user = await db.run_sync(_get_user, form_data.username)
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    valid, new_hash = await hashing.verify_password(form_data.password, user.hashed_password)
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    if new_hash:
+        # Stored hash predates the current pwd_context settings
+        await db.run_sync(_update_password_hash, user, new_hash)
     token_data = {"sub": user.username}
     access_token = utils.create_access_token(token_data)
     refresh_token = utils.create_refresh_token(token_data)
@@ -46,9 +99,12 @@ def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depend
 
 # -------- Refresh Token --------
 @router.post("/refresh")
-def refresh_token(refresh_token: str = Body(...)):
+@database.sync_handler
+def refresh_token(refresh_token: str = Body(...), db: Session = Depends(database.get_db)):
     try:
         payload = utils.decode_token(refresh_token)
+        if payload is None or revocation.store.is_revoked(db, revocation.token_id(payload, refresh_token)):
+            raise HTTPException(status_code=401, detail="Refresh token expired or invalid")
         username = payload.get("sub")
         if not username:
             raise HTTPException(status_code=401, detail="Invalid refresh token")
@@ -59,22 +115,47 @@ def refresh_token(refresh_token: str = Body(...)):
 
 # -------- Logout --------
 @router.post("/logout")
-def logout(request: Request, token: str = Depends(oauth2_scheme)):
-    if utils.is_token_blacklisted(token):
+@database.sync_handler
+def logout(request: Request, token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
+    payload = utils.decode_token(token)
+    if payload is None:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    jti = revocation.token_id(payload, token)
+    if revocation.store.is_revoked(db, jti):
         raise HTTPException(status_code=401, detail="Already logged out")
-    utils.blacklist_token(token)
+    if not revocation.store.revoke(db, jti, datetime.utcfromtimestamp(payload["exp"])):
+        raise HTTPException(status_code=401, detail="Already logged out")
+    principal_cache.pop(_token_key(token))
     return {"message": "Logged out successfully"}
 
 # -------- Get Current User --------
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> models.User:
-    if utils.is_token_blacklisted(token):
-        raise HTTPException(status_code=401, detail="Token has been revoked")
+@database.sync_handler
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)) -> Principal:
+    key = _token_key(token)
+    principal = principal_cache.get(key)
+    if principal is not None:
+        # Revocation is still checked on a hit, so a revoked token is never served from the cache
+        if revocation.store.is_revoked(db, revocation.token_id(principal.claims, token)):
+            raise HTTPException(status_code=401, detail="Token has been revoked")
+        # The handler shares this session; its commits count as this user's writes for read routing
+        db.info["user_id"] = principal.id
+        return principal
+
+    generation = principal_cache.generation
     payload = utils.decode_token(token)
     if payload is None:
         raise HTTPException(status_code=401, detail="Invalid token")
+    if revocation.store.is_revoked(db, revocation.token_id(payload, token)):
+        raise HTTPException(status_code=401, detail="Token has been revoked")
     username = payload.get("sub")
-    user = db.query(models.User).filter(models.User.username == username).first()
+    user = db.query(models.User.id, models.User.username).filter(models.User.username == username).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    return user
+    principal = Principal(id=user.id, username=user.username, claims=payload)
+    principal_cache.set(key, principal, generation, ttl=payload["exp"] - time.time())
+    db.info["user_id"] = principal.id
+    return principal
+
+# Session for read-only handlers: a replica unless the user wrote within READ_YOUR_WRITES_SECONDS
+get_read_db = database.read_db(get_current_user)
 
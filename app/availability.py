@@ -0,0 +1,60 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+from typing import List
+from datetime import datetime
+
+from . import schemas, database, auth, intervals
+
+router = APIRouter(prefix="/api/availability", tags=["Availability"])
+
+def _conflicts(tree: intervals.IntervalTree, slot: schemas.ConflictCheck) -> dict:
+    start, end = intervals.naive_utc(slot.start_time), intervals.naive_utc(slot.end_time)
+    found = tree.overlaps(start, end, slot.exclude_event_id)
+    return {
+        "start_time": start,
+        "end_time": end,
+        "conflict": bool(found),
+        "conflicts": [{"event_id": event_id, "start_time": item_start, "end_time": item_end} for item_start, item_end, event_id in found],
+    }
+
+# ---------------- Free/Busy ----------------
+@router.get("/freebusy", response_model=schemas.FreeBusyOut)
+@database.sync_handler
+def get_freebusy(
+    start: datetime = Query(..., alias="from"),
+    end: datetime = Query(..., alias="to"),
+    db: Session = Depends(database.get_db),
+    current_user: auth.Principal = Depends(auth.get_current_user),
+):
+    start, end = intervals.naive_utc(start), intervals.naive_utc(end)
+    if end <= start:
+        raise HTTPException(status_code=400, detail="'to' must be after 'from'")
+
+    tree = intervals.tree_for(db, current_user.id, start, end)
+    busy = intervals.busy_blocks(tree.overlaps(start, end), start, end)
+    free = intervals.free_blocks(busy, start, end)
+    return {
+        "start_time": start,
+        "end_time": end,
+        "busy": [{"start_time": s, "end_time": e} for s, e in busy],
+        "free": [{"start_time": s, "end_time": e} for s, e in free],
+    }
+
+# ---------------- Conflict Check ----------------
+@router.post("/conflicts", response_model=schemas.ConflictResult)
+@database.sync_handler
+def check_conflicts(slot: schemas.ConflictCheck, db: Session = Depends(database.get_db), current_user: auth.Principal = Depends(auth.get_current_user)):
+    tree = intervals.tree_for(db, current_user.id, intervals.naive_utc(slot.start_time), intervals.naive_utc(slot.end_time))
+    return _conflicts(tree, slot)
+
+# ---------------- Batch Conflict Check ----------------
+@router.post("/conflicts/batch", response_model=List[schemas.ConflictResult])
+@database.sync_handler
+def check_conflicts_batch(slots: List[schemas.ConflictCheck], db: Session = Depends(database.get_db), current_user: auth.Principal = Depends(auth.get_current_user)):
+    if not slots:
+        return []
+    # One tree (or one range query covering every slot) answers the whole batch
+    start = min(intervals.naive_utc(slot.start_time) for slot in slots)
+    end = max(intervals.naive_utc(slot.end_time) for slot in slots)
+    tree = intervals.tree_for(db, current_user.id, start, end)
+    return [_conflicts(tree, slot) for slot in slots]
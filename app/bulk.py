@@ -0,0 +1,221 @@
+import io
+import json
+import os
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy import insert, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from . import models, schemas, access, etags, feed, recurrence, versioning
+
+BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", 500))
+BATCH_COPY_THRESHOLD = int(os.getenv("BATCH_COPY_THRESHOLD", 5000))
+
+EVENT_COLUMNS = ["title", "description", "start_time", "end_time", "location", "is_recurring", "recurrence_pattern"]
+
+# ---------------- Validation ----------------
+def validate_events(items: List[Dict[str, Any]]) -> Tuple[List[schemas.EventCreate], List[dict]]:
+    # Invalid items are reported by their position in the payload instead of failing the whole batch
+    valid, errors = [], []
+    for index, raw in enumerate(items):
+        try:
+            valid.append(schemas.EventCreate.parse_obj(raw))
+        except ValidationError as exc:
+            errors.append({"index": index, "errors": json.loads(exc.json())})
+    return valid, errors
+
+def chunks(seq: list, size: int):
+    for start in range(0, len(seq), size):
+        yield seq[start:start + size]
+
+# ---------------- Multi-row INSERT ... RETURNING ----------------
+def insert_events(db: Session, creator_id: int, events: List[schemas.EventCreate], chunk_size: int = BATCH_CHUNK_SIZE) -> List[models.Event]:
+    created = []
+    for chunk in chunks(events, chunk_size):
+        rows = [dict(event.dict(), creator_id=creator_id) for event in chunk]
+        new_events = db.scalars(
+            insert(models.Event).returning(models.Event, sort_by_parameter_order=True), rows
+        ).all()
+        db.execute(insert(models.Permission), [
+            {"user_id": creator_id, "event_id": new_event.id, "role": models.RoleEnum.owner}
+            for new_event in new_events
+        ])
+        created.extend(new_events)
+    return created
+
+# ---------------- Multi-row upsert ----------------
+def upsert(db: Session, model, rows: List[dict], keys: List[str], update: List[str] = (), chunk_size: int = BATCH_CHUNK_SIZE):
+    # INSERT ... ON CONFLICT (keys) DO UPDATE (or DO NOTHING), one statement per chunk. Rows must be
+    # unique on keys: a statement may not update the same row twice.
+    dialect = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+    for chunk in chunks(rows, chunk_size):
+        statement = dialect.insert(model).values(chunk)
+        if update:
+            statement = statement.on_conflict_do_update(
+                index_elements=keys, set_={name: statement.excluded[name] for name in update}
+            )
+        else:
+            statement = statement.on_conflict_do_nothing(index_elements=keys)
+        db.execute(statement)
+
+def insert_new(db: Session, model, rows: List[dict], returning, chunk_size: int = BATCH_CHUNK_SIZE) -> list:
+    # INSERT ... ON CONFLICT DO NOTHING RETURNING, one statement per chunk: rows that would violate any
+    # unique constraint are skipped by the database, so concurrent writers cannot slip in a duplicate
+    dialect = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+    inserted = []
+    for chunk in chunks(rows, chunk_size):
+        inserted.extend(db.execute(dialect.insert(model).values(chunk).on_conflict_do_nothing().returning(*returning)))
+    return inserted
+
+# ---------------- COPY fast path (PostgreSQL + psycopg2) ----------------
+def can_copy(db: Session, count: int) -> bool:
+    dialect = db.get_bind().dialect
+    return count >= BATCH_COPY_THRESHOLD and dialect.name == "postgresql" and dialect.driver == "psycopg2"
+
+def _copy_value(value) -> str:
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+def _copy_line(values) -> str:
+    return "\t".join(_copy_value(value) for value in values) + "\n"
+
+def copy_events(db: Session, creator_id: int, events: List[schemas.EventCreate]) -> List[models.Event]:
+    conn = db.connection()
+    # COPY cannot return generated keys, so reserve the ids up front
+    ids = conn.execute(
+        text("SELECT nextval(pg_get_serial_sequence('events', 'id')) FROM generate_series(1, :n)"),
+        {"n": len(events)},
+    ).scalars().all()
+    now = datetime.now(timezone.utc)
+
+    event_buf, permission_buf = io.StringIO(), io.StringIO()
+    created = []
+    for event_id, event in zip(ids, events):
+        values = event.dict()
+        event_buf.write(_copy_line([event_id, *(values[c] for c in EVENT_COLUMNS), now, creator_id]))
+        permission_buf.write(_copy_line([creator_id, event_id, models.RoleEnum.owner.name]))
+        # Transient objects never flushed: fields the database defaults are filled in here for the response
+        created.append(models.Event(id=event_id, created_at=now, creator_id=creator_id, version=1, **values))
+    event_buf.seek(0)
+    permission_buf.seek(0)
+
+    cursor = conn.connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY events (id, {', '.join(EVENT_COLUMNS)}, created_at, creator_id) FROM STDIN", event_buf
+        )
+        cursor.copy_expert("COPY permissions (user_id, event_id, role) FROM STDIN", permission_buf)
+    finally:
+        cursor.close()
+    return created
+
+def create_events(db: Session, creator_id: int, events: List[schemas.EventCreate], chunk_size: int = BATCH_CHUNK_SIZE) -> List[models.Event]:
+    if not events:
+        return []
+    if can_copy(db, len(events)):
+        created = copy_events(db, creator_id, events)
+    else:
+        created = insert_events(db, creator_id, events, chunk_size)
+    for chunk in chunks(created, chunk_size):
+        recurrence.index_events(db, chunk)
+    return created
+
+# ---------------- Batch update ----------------
+def update_events(db: Session, user_id: int, patches: List[schemas.EventPatch]) -> Tuple[List[dict], List[int]]:
+    # Returns per-item results in payload order and the ids whose schedule changed
+    ids = [patch.id for patch in patches]
+    masks = access.get_role_masks(db, user_id, ids)
+    events = {event.id: event for event in db.query(models.Event).filter(models.Event.id.in_(ids))}
+
+    results, changes, seen = [], [], set()
+    for patch in patches:
+        event = events.get(patch.id)
+        result = {"id": patch.id}
+        results.append(result)
+        if patch.id in seen:
+            result.update(status="invalid", detail="Duplicate id in batch")
+        elif not masks[patch.id] & access.CAN_EDIT:
+            result.update(status="forbidden", detail="Insufficient permissions")
+        elif event is None:
+            result.update(status="not_found", detail="Event not found")
+        elif patch.version is not None and patch.version != event.version:
+            result.update(status="conflict", detail="Event was modified; reload it and retry", version=event.version)
+        else:
+            # Patch times arrive as naive UTC. Only the patched fields can fail the merge (EventUpdate does
+            # not check the pattern), and the pattern is checked only when it or is_recurring changes, so
+            # an event stored with a legacy pattern can still be patched
+            fields = patch.dict(exclude_unset=True, exclude={"id", "version"})
+            current = {column: getattr(event, column) for column in EVENT_COLUMNS}
+            try:
+                new_values = schemas.EventUpdate.parse_obj({**current, **fields}).dict()
+                if recurrence.schedule_changed(event, fields):
+                    recurrence.check_pattern(new_values["recurrence_pattern"], new_values["is_recurring"])
+            except ValidationError as exc:
+                result.update(status="invalid", errors=json.loads(exc.json()))
+            except ValueError as exc:
+                result.update(status="invalid", detail=str(exc))
+            else:
+                changes.append((event, new_values, result))
+        seen.add(patch.id)
+
+    versioning.record_changes(db, [(event, new_values) for event, new_values, _ in changes], user_id)
+    rescheduled = []
+    for event, new_values, _ in changes:
+        previous = recurrence.schedule_key(event)
+        for attr, value in new_values.items():
+            setattr(event, attr, value)
+        if recurrence.schedule_key(event) != previous:
+            rescheduled.append(event)
+    if rescheduled:
+        recurrence.clear_events(db, [event.id for event in rescheduled])
+        for chunk in chunks(rescheduled, BATCH_CHUNK_SIZE):
+            recurrence.index_events(db, chunk)
+    if changes:
+        etags.bump_event(db, *(event.id for event, _, _ in changes))
+    db.flush()
+    for event, _, result in changes:
+        result.update(status="updated", version=event.version)
+    return results, [event.id for event in rescheduled]
+
+# ---------------- Batch delete ----------------
+def delete_events(db: Session, user_id: int, ids: List[int]) -> Tuple[List[dict], List[int]]:
+    # Returns per-id results in payload order and the ids that were deleted
+    masks = access.get_role_masks(db, user_id, ids)
+    existing = {event_id for (event_id,) in db.query(models.Event.id).filter(models.Event.id.in_(ids))}
+
+    results, deleted, seen = [], [], set()
+    for event_id in ids:
+        if event_id in seen:
+            results.append({"id": event_id, "status": "invalid", "detail": "Duplicate id in batch"})
+        elif not masks[event_id] & access.CAN_DELETE:
+            results.append({"id": event_id, "status": "forbidden", "detail": "Only owner can delete the event"})
+        elif event_id not in existing:
+            results.append({"id": event_id, "status": "not_found", "detail": "Event not found"})
+        else:
+            results.append({"id": event_id, "status": "deleted"})
+            deleted.append(event_id)
+        seen.add(event_id)
+
+    if deleted:
+        recurrence.clear_events(db, deleted)
+        etags.bump_event(db, *deleted)
+        feed.notify(db, "event.deleted", {event_id: {} for event_id in deleted}, user_id)
+        # Set-based version of what session.delete() does per event: detach permissions and history, then delete
+        for model in (models.Permission, models.GroupPermission, models.EventHistory):
+            db.query(model).filter(model.event_id.in_(deleted)).update({model.event_id: None}, synchronize_session=False)
+        db.query(models.Event).filter(models.Event.id.in_(deleted)).delete(synchronize_session=False)
+    return results, deleted
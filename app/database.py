@@ -1,12 +1,223 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from fastapi import Depends, params
+from starlette.concurrency import run_in_threadpool
+import inspect
+import itertools
 import os
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# "sync" runs queries on the threadpool through psycopg2, "async" on the event loop through asyncpg
+DB_MODE = os.getenv("DB_MODE", "sync").lower()
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+# Comma-separated replica URLs for read-only handlers; empty sends everything to DATABASE_URL
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+# After a user commits, their reads stay on the primary this long so they see their own writes
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", 5))
+
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+def pool_options(url: str) -> dict:
+    # SQLite manages its own connections; the pool knobs are for server databases
+    if make_url(url).get_backend_name() == "sqlite":
+        return {}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+def async_url(url: str) -> str:
+    parsed = make_url(url)
+    return parsed.set(drivername=ASYNC_DRIVERS.get(parsed.get_backend_name(), parsed.drivername)).render_as_string(hide_password=False)
+
+# The sync engine is always available for create_all, scripts and benchmarks
+engine = create_engine(DATABASE_URL, **pool_options(DATABASE_URL))
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
 Base = declarative_base()
+
+async_engine = None
+AsyncSessionLocal = None
+if DB_MODE == "async":
+    # Needs greenlet and an asyncio driver (asyncpg / aiosqlite)
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+    async_engine = create_async_engine(ASYNC_DATABASE_URL or async_url(DATABASE_URL), **pool_options(DATABASE_URL))
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+# Replica sessions carry info["replica"], so shared caches can refuse data that may lag the primary
+replica_engines = [create_engine(url, **pool_options(url)) for url in DATABASE_REPLICA_URLS]
+ReplicaSessions = [
+    sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=replica, info={"replica": True})
+    for replica in replica_engines
+]
+async_replica_engines = []
+AsyncReplicaSessions = []
+if DB_MODE == "async":
+    async_replica_engines = [create_async_engine(async_url(url), **pool_options(url)) for url in DATABASE_REPLICA_URLS]
+    AsyncReplicaSessions = [
+        async_sessionmaker(replica, autoflush=False, expire_on_commit=False, info={"replica": True})
+        for replica in async_replica_engines
+    ]
+_next_replica = itertools.count()
+
+def sync_engines():
+    # Every engine that executes statements (async engines through their sync_engine), for event listeners
+    engines = [engine, *replica_engines]
+    if async_engine is not None:
+        engines.append(async_engine.sync_engine)
+    return engines + [replica.sync_engine for replica in async_replica_engines]
+
+# Gives a sync Session the run_sync() interface of AsyncSession; the work runs on the threadpool
+class SyncSessionRunner:
+    def __init__(self, session):
+        self.sync_session = session
+
+    async def run_sync(self, fn, *args, **kwargs):
+        return await run_in_threadpool(fn, self.sync_session, *args, **kwargs)
+
+    async def close(self):
+        await run_in_threadpool(self.sync_session.close)
+
+async def _open(session_factory, async_session_factory):
+    if async_session_factory is not None:
+        async with async_session_factory() as session:
+            yield session
+    else:
+        runner = SyncSessionRunner(session_factory())
+        try:
+            yield runner
+        finally:
+            await runner.close()
+
+async def get_db():
+    async for session in _open(SessionLocal, AsyncSessionLocal):
+        yield session
+
+# ---------- Read replicas ----------
+# user id -> monotonic time until which the user's reads stay on the primary. Per process: with
+# several workers, sticky routing (or a longer window) keeps a user's reads on the worker that wrote.
+_recent_writers = {}
+
+def is_replica(db: Session) -> bool:
+    return db.info.get("replica", False)
+
+def note_write(user_id: int):
+    now = time.monotonic()
+    if len(_recent_writers) > 10000:
+        for stale in [key for key, until in _recent_writers.items() if until <= now]:
+            del _recent_writers[stale]
+    _recent_writers[user_id] = now + READ_YOUR_WRITES_SECONDS
+
+def wrote_recently(user_id: int) -> bool:
+    return _recent_writers.get(user_id, 0) > time.monotonic()
+
+# Sessions tagged with info["user_id"] (see auth.get_current_user) mark that user as a recent writer
+@event.listens_for(Session, "after_commit")
+def _note_commit(session):
+    user_id = session.info.get("user_id")
+    if user_id is not None and not is_replica(session):
+        note_write(user_id)
+
+def read_db(principal_dependency):
+    # Builds the read-only counterpart of get_db: a replica session, round-robin, unless there are no
+    # replicas or the principal wrote within READ_YOUR_WRITES_SECONDS. The primary session is the
+    # request's cached get_db session, so falling back opens nothing new.
+    async def get_read_db(current_user=Depends(principal_dependency), primary=Depends(get_db)):
+        if not ReplicaSessions or wrote_recently(current_user.id):
+            yield primary
+            return
+        index = next(_next_replica) % len(ReplicaSessions)
+        async for session in _open(ReplicaSessions[index], AsyncReplicaSessions[index] if AsyncReplicaSessions else None):
+            yield session
+
+    get_read_db.provides_session = True
+    return get_read_db
+
+def session_factories(db: Session):
+    # The (sync, async) factories for the database db reads from, so a stream that outlives the
+    # request stays on the same primary or replica as the rest of the request
+    bind = db.get_bind()
+    for index, replica in enumerate(replica_engines):
+        if bind is replica or (async_replica_engines and bind is async_replica_engines[index].sync_engine):
+            return ReplicaSessions[index], AsyncReplicaSessions[index] if AsyncReplicaSessions else None
+    return SessionLocal, AsyncSessionLocal
+
+async def stream_rows(statement, yield_per: int = 500, sessions=None):
+    # Server-side cursor on a session owned by the stream, so it outlives the request's dependencies;
+    # sessions is a session_factories() pair, the primary by default
+    session_factory, async_session_factory = sessions or (SessionLocal, AsyncSessionLocal)
+    statement = statement.execution_options(yield_per=yield_per)
+    if async_session_factory is not None:
+        async with async_session_factory() as session:
+            result = await session.stream(statement)
+            async for partition in result.partitions():
+                for row in partition:
+                    yield row
+    else:
+        session = session_factory()
+        try:
+            result = await run_in_threadpool(session.execute, statement)
+            while True:
+                rows = await run_in_threadpool(result.fetchmany, yield_per)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+        finally:
+            await run_in_threadpool(session.close)
+
+async def run_in_session(fn, *args):
+    # fn(sync_session, *args) on a session owned by the call; for work that outlives the request's
+    # dependencies, such as a streaming response that writes as it goes
+    if AsyncSessionLocal is not None:
+        async with AsyncSessionLocal() as session:
+            return await session.run_sync(fn, *args)
+    runner = SyncSessionRunner(SessionLocal())
+    try:
+        return await runner.run_sync(fn, *args)
+    finally:
+        await runner.close()
+
+def sync_handler(fn):
+    # Lets a handler (or dependency) keep its synchronous body: the parameter declared as
+    # Depends(get_db) (or a read_db() dependency) is swapped for the sync Session of the request's session, and the body
+    # runs through run_sync(), on the threadpool in sync mode or the event loop in async mode.
+    signature = inspect.signature(fn)
+    db_param = next(
+        name for name, param in signature.parameters.items()
+        if isinstance(param.default, params.Depends)
+        and (param.default.dependency is get_db or getattr(param.default.dependency, "provides_session", False))
+    )
+
+    async def wrapper(**kwargs):
+        session = kwargs.pop(db_param)
+        return await session.run_sync(lambda sync_session: fn(**kwargs, **{db_param: sync_session}))
+
+    # No __wrapped__: FastAPI would unwrap it and treat the handler as sync
+    wrapper.__signature__ = signature
+    wrapper.__name__ = fn.__name__
+    wrapper.__qualname__ = fn.__qualname__
+    wrapper.__doc__ = fn.__doc__
+    wrapper.__module__ = fn.__module__
+    return wrapper
+
+async def init_db(metadata):
+    if async_engine is not None:
+        async with async_engine.begin() as conn:
+            await conn.run_sync(metadata.create_all)
+    else:
+        await run_in_threadpool(metadata.create_all, bind=engine)
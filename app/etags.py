@@ -0,0 +1,58 @@
+import hashlib
+from typing import Iterable, Optional
+
+from fastapi import HTTPException, Request, Response
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from . import models, access
+
+# ---------- Tags ----------
+def make_etag(kind: str, key: int, version: int, request: Optional[Request] = None) -> str:
+    # Strong tag; list endpoints fold the query string in so each page/filter gets its own tag
+    tag = f"{kind}{key}-v{version}"
+    if request is not None and request.url.query:
+        tag += "-" + hashlib.sha1(request.url.query.encode()).hexdigest()[:12]
+    return f'"{tag}"'
+
+def event_etag(event) -> str:
+    return make_etag("e", event.id, event.version)
+
+def _header_tags(value: str) -> set:
+    return {tag.strip().removeprefix("W/") for tag in value.split(",") if tag.strip()}
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    # A bodyless 304 when If-None-Match already names this representation (weak comparison)
+    header = request.headers.get("if-none-match")
+    if header and (header.strip() == "*" or etag in _header_tags(header)):
+        return Response(status_code=304, headers={"ETag": etag})
+    return None
+
+def require_match(request: Request, etag: str):
+    header = request.headers.get("if-match")
+    if header and header.strip() != "*" and etag not in _header_tags(header):
+        raise HTTPException(status_code=412, detail="Event was modified; reload it and retry", headers={"ETag": etag})
+
+# ---------- Per-user listing watermark ----------
+def listing_version(db: Session, user_id: int) -> int:
+    return db.query(models.User.listing_version).filter_by(id=user_id).scalar() or 0
+
+def _bump(db: Session, user_filter):
+    # Query-level UPDATE: no ORM load, and no User after_update events (principal cache stays warm)
+    db.query(models.User).filter(user_filter).update(
+        {models.User.listing_version: models.User.listing_version + 1}, synchronize_session=False
+    )
+
+def bump_users(db: Session, user_ids: Iterable[int]):
+    user_ids = set(user_ids)
+    if user_ids:
+        _bump(db, models.User.id.in_(user_ids))
+
+def bump_groups(db: Session, group_ids: Iterable[int]):
+    # Every member, resolved in the UPDATE itself
+    members = select(models.GroupMember.user_id).where(models.GroupMember.group_id.in_(list(group_ids)))
+    _bump(db, models.User.id.in_(members))
+
+def bump_event(db: Session, *event_ids: int):
+    # Everyone who can see the events, directly or through a group
+    _bump(db, models.User.id.in_(access.audience(event_ids)))
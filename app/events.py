@@ -1,24 +1,23 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List
-from datetime import datetime
+from typing import Any, Dict, List, Optional
+from datetime import datetime, timezone
 
-from . import models, schemas, database, auth
+from . import models, schemas, database, auth, access, admission, bulk, etags, feed, intervals, pagination, recurrence, search, serialization, transfer, versioning
 
-router = APIRouter(prefix="/api/events", tags=["Events"])
+EVENT_FIELDS = list(schemas.EventOut.__fields__)
 
-get_db = database.SessionLocal
+router = APIRouter(prefix="/api/events", tags=["Events"])
 
-def get_db():
-    db = database.SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# Batch writes, import and export can hold a transaction or a stream for a long time
+bulk_limit = admission.limit("bulk", admission.RATE_LIMIT_BULK, admission.BULK_CONCURRENCY, principal=auth.get_current_user)
+batch_size = admission.max_items(admission.BATCH_MAX_ITEMS)
 
 # ---------------- Create Event ----------------
 @router.post("/", response_model=schemas.EventOut)
-def create_event(event: schemas.EventCreate, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
+@database.sync_handler
+def create_event(event: schemas.EventCreate, db: Session = Depends(database.get_db), current_user: auth.Principal = Depends(auth.get_current_user)):
     new_event = models.Event(
         title=event.title,
         description=event.description,
@@ -36,98 +35,289 @@ def create_event(event: schemas.EventCreate, db: Session = Depends(get_db), curr
     # Assign the creator as Owner
     permission = models.Permission(user_id=current_user.id, event_id=new_event.id, role="Owner")
     db.add(permission)
+    recurrence.index_events(db, [new_event])
+    etags.bump_users(db, [current_user.id])
     db.commit()
+    access.invalidate(current_user.id, new_event.id)
+    intervals.invalidate_user(current_user.id)
 
     return new_event
 
 # ---------------- Get All Events (paginated) ----------------
 @router.get("/", response_model=List[schemas.EventOut])
-def get_events(skip: int = 0, limit: int = 10, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
-    permissions = db.query(models.Permission).filter(models.Permission.user_id == current_user.id).all()
-    event_ids = [p.event_id for p in permissions]
-    events = db.query(models.Event).filter(models.Event.id.in_(event_ids)).offset(skip).limit(limit).all()
-    return events
+@database.sync_handler
+def get_events(
+    request: Request,
+    limit: int = Query(10, ge=1),
+    cursor: Optional[str] = None,
+    skip: Optional[int] = Query(None, ge=0),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    role: Optional[schemas.RoleEnum] = None,
+    is_recurring: Optional[bool] = None,
+    q: Optional[str] = Query(None, min_length=1, max_length=200, description="Full-text search over title, description and location; results are ranked by relevance"),
+    fields: Optional[str] = Query(None, description="Comma-separated subset of event fields to return"),
+    as_of: Optional[datetime] = Query(None, description="Return the events as they were at this time, rebuilt from their history"),
+    db: Session = Depends(auth.get_read_db),
+    current_user: auth.Principal = Depends(auth.get_current_user),
+):
+    # Plain column rows: no ORM identity map, no response_model validation
+    selected = serialization.parse_fields(fields, EVENT_FIELDS)
+    # The watermark moves on any change to the user's events, so a match means the page is unchanged
+    etag = etags.make_etag("l", current_user.id, etags.listing_version(db, current_user.id), request)
+    cached = etags.not_modified(request, etag)
+    if cached:
+        return cached
+    if as_of is not None:
+        if q is not None:
+            raise HTTPException(status_code=400, detail="q cannot be combined with as_of")
+        return _events_as_of(db, current_user.id, as_of, limit, cursor, skip, start, end, role, is_recurring, selected, etag)
+    columns = [models.Event.__table__.c[name] for name in EVENT_FIELDS if name in selected or name in ("start_time", "id")]
+    # Direct and group grants; with role=, only events where that is the caller's strongest role
+    query = db.query(*columns).filter(
+        models.Event.id.in_(access.visible_event_ids(current_user.id, models.RoleEnum(role.value) if role is not None else None))
+    )
+    # Events overlapping the [start, end) window
+    if start is not None:
+        query = query.filter(models.Event.end_time >= start)
+    if end is not None:
+        query = query.filter(models.Event.start_time < end)
+    if is_recurring is not None:
+        query = query.filter(models.Event.is_recurring == is_recurring)
+
+    headers = {"ETag": etag}
+    if q is not None:
+        # Relevance order; the cursor carries an offset since scores give no keyset
+        query, score = search.match(query, q, db.get_bind().dialect.name)
+        query = query.order_by(score.desc(), models.Event.id)
+        offset = pagination.decode_offset_cursor(cursor) if cursor else (skip or 0)
+        rows = query.offset(offset).limit(limit).all()
+        if len(rows) == limit:
+            headers[pagination.NEXT_CURSOR_HEADER] = pagination.encode_offset_cursor(offset + limit)
+        return serialization.FastJSONResponse(serialization.project(rows, selected), headers=headers)
+
+    query = query.order_by(models.Event.start_time, models.Event.id)
+    if cursor:
+        query = query.filter(pagination.after_cursor(models.Event.start_time, models.Event.id, cursor))
+    elif skip:
+        # OFFSET compatibility mode
+        query = query.offset(skip)
+
+    rows = query.limit(limit).all()
+    if len(rows) == limit:
+        last = rows[-1]
+        headers[pagination.NEXT_CURSOR_HEADER] = pagination.encode_cursor(last.start_time, last.id)
+    return serialization.FastJSONResponse(serialization.project(rows, selected), headers=headers)
+
+def _events_as_of(db: Session, user_id: int, as_of: datetime, limit: int, cursor: Optional[str], skip: Optional[int], start, end, role, is_recurring, selected: List[str], etag: str):
+    # Access is today's; titles and times are as of then. Times may have changed since, so the window,
+    # order and cursor are applied to the rebuilt states rather than in SQL.
+    visible = access.visible_event_ids(user_id, models.RoleEnum(role.value) if role is not None else None)
+    # Event times are stored naive; an offset in the window bounds is resolved to UTC
+    start, end = (value.astimezone(timezone.utc).replace(tzinfo=None) if value and value.tzinfo else value for value in (start, end))
+    states = [
+        state for state in versioning.states_as_of(db, visible, versioning.as_of_utc(as_of))
+        if (start is None or state["end_time"] >= start)
+        and (end is None or state["start_time"] < end)
+        and (is_recurring is None or state["is_recurring"] == is_recurring)
+    ]
+    states.sort(key=lambda state: (state["start_time"], state["id"]))
+    if cursor:
+        after = pagination.decode_cursor(cursor)
+        states = [state for state in states if (state["start_time"], state["id"]) > after]
+    elif skip:
+        states = states[skip:]
+
+    page = states[:limit]
+    headers = {"ETag": etag}
+    if len(page) == limit and len(states) > limit:
+        headers[pagination.NEXT_CURSOR_HEADER] = pagination.encode_cursor(page[-1]["start_time"], page[-1]["id"])
+    return serialization.FastJSONResponse([{name: state[name] for name in selected} for state in page], headers=headers)
+
+# ---------------- Occurrences ----------------
+# Declared before /{event_id} so "occurrences" is not parsed as an id
+@router.get("/occurrences", response_model=List[schemas.OccurrenceOut])
+@database.sync_handler
+def get_occurrences(
+    response: Response,
+    start: datetime = Query(..., alias="from"),
+    end: datetime = Query(..., alias="to"),
+    limit: int = Query(100, ge=1, le=recurrence.OCCURRENCE_MAX_PER_EVENT),
+    cursor: Optional[str] = None,
+    db: Session = Depends(database.get_db),
+    current_user: auth.Principal = Depends(auth.get_current_user),
+):
+    start, end = intervals.naive_utc(start), intervals.naive_utc(end)
+    if end <= start:
+        raise HTTPException(status_code=400, detail="'to' must be after 'from'")
+    if end > recurrence.horizon():
+        raise HTTPException(status_code=400, detail=f"'to' is beyond the {recurrence.OCCURRENCE_HORIZON_DAYS}-day occurrence horizon")
+    if end <= recurrence.lookback():
+        raise HTTPException(status_code=400, detail=f"'to' is before the {recurrence.OCCURRENCE_LOOKBACK_DAYS}-day occurrence look-back")
+
+    Occurrence = models.EventOccurrence
+    query = (
+        db.query(Occurrence.id, Occurrence.event_id, Occurrence.start_time, Occurrence.end_time, models.Event.title, models.Event.location)
+        .join(models.Event, models.Event.id == Occurrence.event_id)
+        .filter(Occurrence.event_id.in_(access.visible_event_ids(current_user.id)), Occurrence.start_time < end, Occurrence.end_time > start)
+        .order_by(Occurrence.start_time, Occurrence.id)
+    )
+    if cursor:
+        query = query.filter(pagination.after_cursor(Occurrence.start_time, Occurrence.id, cursor))
+
+    rows = query.limit(limit).all()
+    if len(rows) == limit:
+        last = rows[-1]
+        response.headers[pagination.NEXT_CURSOR_HEADER] = pagination.encode_cursor(last.start_time, last.id)
+    return [row._asdict() for row in rows]
+
+# ---------------- Batch Update / Delete ----------------
+# Declared before /{event_id} for the same reason as /occurrences
+@router.patch("/batch", response_model=schemas.BatchWriteOut, dependencies=[bulk_limit, batch_size])
+@database.sync_handler
+def batch_update(patches: List[schemas.EventPatch], db: Session = Depends(database.get_db), current_user: auth.Principal = Depends(auth.get_current_user)):
+    results, rescheduled = bulk.update_events(db, current_user.id, patches)
+    updated = {result["id"]: {"version": result["version"]} for result in results if result["status"] == "updated"}
+    feed.notify(db, "event.updated", updated, current_user.id)
+    db.commit()
+    intervals.invalidate_events(rescheduled)
+    return {"results": results}
+
+@router.delete("/batch", response_model=schemas.BatchWriteOut, dependencies=[bulk_limit, batch_size])
+@database.sync_handler
+def batch_delete(ids: List[int] = Body(...), db: Session = Depends(database.get_db), current_user: auth.Principal = Depends(auth.get_current_user)):
+    results, deleted = bulk.delete_events(db, current_user.id, ids)
+    db.commit()
+    access.invalidate_events(deleted)
+    intervals.invalidate_events(deleted)
+    return {"results": results}
+
+# ---------------- Export / Import ----------------
+def _transfer_format(fmt: Optional[str], content_type: str = "") -> str:
+    if fmt is None:
+        fmt = "ics" if content_type.startswith(transfer.FORMATS["ics"]) else "ndjson"
+    if fmt not in transfer.FORMATS:
+        raise HTTPException(status_code=400, detail="format must be one of: " + ", ".join(transfer.FORMATS))
+    return fmt
+
+@router.get("/export", dependencies=[bulk_limit])
+async def export_events(format: str = Query("ics"), current_user: auth.Principal = Depends(auth.get_current_user)):
+    fmt = _transfer_format(format)
+    return StreamingResponse(
+        transfer.export_events(current_user.id, fmt),
+        media_type=transfer.FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="events.{fmt}"'},
+    )
+
+@router.post("/import", dependencies=[bulk_limit])
+async def import_events(request: Request, format: Optional[str] = None, current_user: auth.Principal = Depends(auth.get_current_user)):
+    # Raw request body (text/calendar or NDJSON), parsed as it streams in; progress comes back as NDJSON
+    fmt = _transfer_format(format, request.headers.get("content-type", ""))
+    return transfer.ProgressResponse(transfer.import_events(current_user.id, fmt, request.stream()), media_type=transfer.FORMATS["ndjson"])
 
 # ---------------- Get Single Event ----------------
 @router.get("/{event_id}", response_model=schemas.EventOut)
-def get_event(event_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
-    permission = db.query(models.Permission).filter_by(user_id=current_user.id, event_id=event_id).first()
-    if not permission:
-        raise HTTPException(status_code=403, detail="Permission denied")
-    
+@database.sync_handler
+def get_event(
+    event_id: int,
+    request: Request,
+    response: Response,
+    as_of: Optional[datetime] = Query(None, description="Return the event as it was at this time, rebuilt from its history"),
+    db: Session = Depends(auth.get_read_db),
+    current_user: auth.Principal = Depends(auth.get_current_user),
+):
+    access.require(db, current_user.id, event_id, access.CAN_VIEW, "Permission denied")
+
+    # Version only, so a 304 never loads or serializes the event
+    version = db.query(models.Event.version).filter_by(id=event_id).scalar()
+    if version is None:
+        raise HTTPException(status_code=404, detail="Event not found")
+    # A past state only moves when the event does, so the live version still keys the tag
+    etag = etags.make_etag("e", event_id, version, request if as_of is not None else None)
+    cached = etags.not_modified(request, etag)
+    if cached:
+        return cached
+
+    if as_of is not None:
+        states = versioning.states_as_of(db, [event_id], versioning.as_of_utc(as_of))
+        if not states:
+            raise HTTPException(status_code=404, detail="Event did not exist at that time")
+        response.headers["ETag"] = etag
+        return states[0]
+
     event = db.query(models.Event).filter_by(id=event_id).first()
     if not event:
         raise HTTPException(status_code=404, detail="Event not found")
+    response.headers["ETag"] = etags.event_etag(event)
     return event
 
 # ---------------- Update Event ----------------
 @router.put("/{event_id}", response_model=schemas.EventOut)
-def update_event(event_id: int, event_data: schemas.EventUpdate, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
-    permission = db.query(models.Permission).filter_by(user_id=current_user.id, event_id=event_id).first()
-    if not permission or permission.role not in ("Owner", "Editor"):
-        raise HTTPException(status_code=403, detail="Insufficient permissions")
+@database.sync_handler
+def update_event(event_id: int, event_data: schemas.EventUpdate, request: Request, response: Response, db: Session = Depends(database.get_db), current_user: auth.Principal = Depends(auth.get_current_user)):
+    access.require(db, current_user.id, event_id, access.CAN_EDIT, "Insufficient permissions")
 
     event = db.query(models.Event).filter_by(id=event_id).first()
     if not event:
         raise HTTPException(status_code=404, detail="Event not found")
+    etags.require_match(request, etags.event_etag(event))
+
+    new_values = event_data.dict()
+    if recurrence.schedule_changed(event, new_values):
+        try:
+            recurrence.check_pattern(new_values["recurrence_pattern"], new_values["is_recurring"])
+        except ValueError as exc:
+            raise HTTPException(status_code=422, detail=str(exc))
 
     # Save current version to history
-    history = models.EventHistory(
-        event_id=event.id,
-        title=event.title,
-        description=event.description,
-        start_time=event.start_time,
-        end_time=event.end_time,
-        location=event.location,
-        recurrence_pattern=event.recurrence_pattern,
-        changed_by=current_user.id,
-    )
-    db.add(history)
+    versioning.record_change(db, event, new_values, current_user.id)
+    previous = recurrence.schedule_key(event)
 
-    for attr, value in event_data.dict().items():
+    for attr, value in new_values.items():
         setattr(event, attr, value)
-    
+    rescheduled = recurrence.reindex_event(db, event, previous)
+    etags.bump_event(db, event_id)
+    db.flush()
+    feed.notify(db, "event.updated", {event_id: {"version": event.version}}, current_user.id)
+
     db.commit()
+    if rescheduled:
+        intervals.invalidate_event(event_id)
     db.refresh(event)
+    response.headers["ETag"] = etags.event_etag(event)
     return event
 
 # ---------------- Delete Event ----------------
 @router.delete("/{event_id}", status_code=204)
-def delete_event(event_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
-    permission = db.query(models.Permission).filter_by(user_id=current_user.id, event_id=event_id).first()
-    if not permission or permission.role != "Owner":
-        raise HTTPException(status_code=403, detail="Only owner can delete the event")
+@database.sync_handler
+def delete_event(event_id: int, request: Request, db: Session = Depends(database.get_db), current_user: auth.Principal = Depends(auth.get_current_user)):
+    access.require(db, current_user.id, event_id, access.CAN_DELETE, "Only owner can delete the event")
 
     event = db.query(models.Event).filter_by(id=event_id).first()
     if not event:
         raise HTTPException(status_code=404, detail="Event not found")
-    
+    etags.require_match(request, etags.event_etag(event))
+
+    recurrence.clear_event(db, event_id)
+    etags.bump_event(db, event_id)
+    # Before the delete detaches its permissions, so everyone who could see the event hears about it
+    feed.notify(db, "event.deleted", {event_id: {}}, current_user.id)
     db.delete(event)
     db.commit()
+    access.invalidate_event(event_id)
+    intervals.invalidate_event(event_id)
     return
 
 # ---------------- Batch Create Events ----------------
-@router.post("/batch", response_model=List[schemas.EventOut])
-def batch_create(events: List[schemas.EventCreate], db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
-    event_list = []
-    for event in events:
-        new_event = models.Event(
-            title=event.title,
-            description=event.description,
-            start_time=event.start_time,
-            end_time=event.end_time,
-            location=event.location,
-            is_recurring=event.is_recurring,
-            recurrence_pattern=event.recurrence_pattern,
-            creator_id=current_user.id,
-        )
-        db.add(new_event)
-        db.commit()
-        db.refresh(new_event)
-        event_list.append(new_event)
-
-        permission = models.Permission(user_id=current_user.id, event_id=new_event.id, role="Owner")
-        db.add(permission)
-        db.commit()
-
-    return event_list
+@router.post("/batch", response_model=schemas.BatchCreateOut, dependencies=[bulk_limit, admission.max_items(admission.BATCH_CREATE_MAX_ITEMS)])
+@database.sync_handler
+def batch_create(events: List[Dict[str, Any]] = Body(...), chunk_size: int = Query(bulk.BATCH_CHUNK_SIZE, ge=1), db: Session = Depends(database.get_db), current_user: auth.Principal = Depends(auth.get_current_user)):
+    valid, errors = bulk.validate_events(events)
+    created = bulk.create_events(db, current_user.id, valid, chunk_size)
+    if created:
+        etags.bump_users(db, [current_user.id])
+    db.commit()
+    for new_event in created:
+        access.invalidate(current_user.id, new_event.id)
+    intervals.invalidate_user(current_user.id)
+    return {"created": created, "errors": errors}
@@ -0,0 +1,296 @@
+import asyncio
+import logging
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set
+
+from fastapi import APIRouter, Depends, HTTPException, Query, WebSocket
+from fastapi.responses import StreamingResponse
+from sqlalchemy import event, func, select, union_all
+from sqlalchemy.orm import Session
+
+from . import models, database, auth, serialization
+
+# "local" delivers within this worker; "database" shares notifications between workers through feed_messages
+FEED_BROKER = os.getenv("FEED_BROKER", "local").lower()
+# Per-subscriber backlog; a subscriber that falls further behind gets a "resync" message instead
+FEED_QUEUE_SIZE = int(os.getenv("FEED_QUEUE_SIZE", 100))
+FEED_HEARTBEAT_SECONDS = float(os.getenv("FEED_HEARTBEAT_SECONDS", 15))
+FEED_POLL_SECONDS = float(os.getenv("FEED_POLL_SECONDS", 0.5))
+FEED_RETENTION_SECONDS = float(os.getenv("FEED_RETENTION_SECONDS", 300))
+# Rows re-read behind the last seen id, so a transaction that commits out of id order is not missed
+FEED_POLL_OVERLAP = 200
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api/feed", tags=["Change Feed"])
+
+# ---------- Subscribers ----------
+class Subscription:
+    def __init__(self, user_id: int, event_ids: Optional[Iterable[int]] = None):
+        self.user_id = user_id
+        self.event_ids = set(event_ids) if event_ids else None
+        self.queue: asyncio.Queue = asyncio.Queue(FEED_QUEUE_SIZE)
+
+    def offer(self, message: dict) -> bool:
+        if self.event_ids is not None and message["event_id"] not in self.event_ids:
+            return True
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            # Slow consumer: drop its backlog and tell it to reload from the REST endpoints
+            dropped = self.queue.qsize()
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({"type": "resync", "dropped": dropped + 1})
+            return False
+
+# In-process pub/sub, owned by the event loop; worker threads hand messages over with deliver_threadsafe
+class Hub:
+    def __init__(self):
+        self.subscribers: Dict[int, Set[Subscription]] = {}
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.published = 0
+        self.delivered = 0
+        self.overflows = 0
+
+    def subscribe(self, user_id: int, event_ids: Optional[Iterable[int]] = None) -> Subscription:
+        subscription = Subscription(user_id, event_ids)
+        self.subscribers.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscriptions = self.subscribers.get(subscription.user_id)
+        if subscriptions is not None:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self.subscribers[subscription.user_id]
+
+    def deliver(self, message: dict):
+        self.published += 1
+        payload = {key: value for key, value in message.items() if key != "recipients"}
+        for user_id in message["recipients"]:
+            for subscription in list(self.subscribers.get(user_id, ())):
+                if subscription.offer(payload):
+                    self.delivered += 1
+                else:
+                    self.overflows += 1
+
+    def deliver_threadsafe(self, message: dict):
+        # Handlers commit on the threadpool (sync mode) or in a greenlet on the loop (async mode)
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.deliver, message)
+
+    def stats(self) -> dict:
+        return {
+            "broker": FEED_BROKER,
+            "subscribers": sum(len(subscriptions) for subscriptions in self.subscribers.values()),
+            "users": len(self.subscribers),
+            "published": self.published,
+            "delivered": self.delivered,
+            "overflows": self.overflows,
+        }
+
+hub = Hub()
+
+# ---------- Brokers ----------
+# A broker takes messages staged on a session and gets them to every worker's hub once the session
+# commits; a rolled-back change publishes nothing. Other backends (Redis, Postgres LISTEN/NOTIFY)
+# implement the same four methods.
+class Broker(ABC):
+    def active(self) -> bool:
+        return True
+
+    @abstractmethod
+    def stage(self, db: Session, message: dict):
+        ...
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+class LocalBroker(Broker):
+    def active(self) -> bool:
+        # Nobody on this worker is listening, so the audience query can be skipped
+        return bool(hub.subscribers)
+
+    def stage(self, db: Session, message: dict):
+        db.info.setdefault("feed_messages", []).append(message)
+
+@event.listens_for(Session, "after_commit")
+def _deliver_staged(session):
+    for message in session.info.pop("feed_messages", ()):
+        hub.deliver_threadsafe(message)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_staged(session):
+    session.info.pop("feed_messages", None)
+
+class DatabaseBroker(Broker):
+    # The message row commits with the change; every worker polls for new rows and feeds its own hub
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self._last_id = 0
+        self._seen: deque = deque()
+        self._seen_ids: Set[int] = set()
+        self._next_prune = 0.0
+
+    def stage(self, db: Session, message: dict):
+        db.add(models.FeedMessage(payload=message, created_at=datetime.utcnow()))
+
+    async def start(self):
+        self._last_id = await database.run_in_session(_max_feed_id)
+        self._task = asyncio.create_task(self._poll())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _poll(self):
+        while True:
+            await asyncio.sleep(FEED_POLL_SECONDS)
+            try:
+                await self.poll_once()
+            except Exception:
+                logger.exception("change feed poll failed")
+
+    async def poll_once(self):
+        rows = await database.run_in_session(_feed_rows_after, self._last_id - FEED_POLL_OVERLAP)
+        for row_id, payload in rows:
+            if row_id in self._seen_ids:
+                continue
+            self._seen.append(row_id)
+            self._seen_ids.add(row_id)
+            self._last_id = max(self._last_id, row_id)
+            hub.deliver(payload)
+        while self._seen and self._seen[0] <= self._last_id - FEED_POLL_OVERLAP:
+            self._seen_ids.discard(self._seen.popleft())
+        if time.monotonic() >= self._next_prune:
+            self._next_prune = time.monotonic() + FEED_RETENTION_SECONDS / 2
+            await database.run_in_session(_prune_feed)
+
+def _max_feed_id(db: Session) -> int:
+    return db.query(func.max(models.FeedMessage.id)).scalar() or 0
+
+def _feed_rows_after(db: Session, row_id: int):
+    FeedMessage = models.FeedMessage
+    return db.query(FeedMessage.id, FeedMessage.payload).filter(FeedMessage.id > row_id).order_by(FeedMessage.id).all()
+
+def _prune_feed(db: Session):
+    cutoff = datetime.utcnow() - timedelta(seconds=FEED_RETENTION_SECONDS)
+    db.query(models.FeedMessage).filter(models.FeedMessage.created_at < cutoff).delete(synchronize_session=False)
+    db.commit()
+
+broker: Broker = DatabaseBroker() if FEED_BROKER == "database" else LocalBroker()
+
+async def start():
+    hub.loop = asyncio.get_running_loop()
+    await broker.start()
+
+async def stop():
+    await broker.stop()
+    hub.loop = None
+
+# ---------- Publishing ----------
+def audience_map(db: Session, event_ids: List[int]) -> Dict[int, Set[int]]:
+    # event_id -> users who can see it, directly or through a group, as of this transaction
+    GroupPermission, GroupMember = models.GroupPermission, models.GroupMember
+    pairs = union_all(
+        select(models.Permission.event_id, models.Permission.user_id).where(models.Permission.event_id.in_(event_ids)),
+        select(GroupPermission.event_id, GroupMember.user_id)
+        .join(GroupMember, GroupMember.group_id == GroupPermission.group_id)
+        .where(GroupPermission.event_id.in_(event_ids)),
+    )
+    audience: Dict[int, Set[int]] = {event_id: set() for event_id in event_ids}
+    for event_id, user_id in db.execute(pairs):
+        audience[event_id].add(user_id)
+    return audience
+
+def notify(db: Session, kind: str, events: Dict[int, dict], changed_by: int):
+    # Stages one message per event for everyone who can see it at this point of the transaction; call it
+    # before access is removed (deletes, revocations) so the users losing access hear about it too
+    if not events or not broker.active():
+        return
+    at = datetime.utcnow().isoformat()
+    for event_id, recipients in audience_map(db, list(events)).items():
+        message = {"type": kind, "event_id": event_id, "changed_by": changed_by, "at": at, **events[event_id]}
+        message["recipients"] = sorted(recipients | {changed_by})
+        broker.stage(db, message)
+
+# ---------- Subscriptions ----------
+async def authenticate(token: Optional[str]) -> auth.Principal:
+    # The session is closed before streaming starts, so a long-lived subscription holds no connection
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    sessions = database.get_db()
+    db = await sessions.__anext__()
+    try:
+        return await auth.get_current_user(token=token, db=db)
+    finally:
+        await sessions.aclose()
+
+def _sse(kind: str, data: bytes) -> bytes:
+    return b"event: " + kind.encode() + b"\ndata: " + data + b"\n\n"
+
+async def _event_stream(user_id: int, event_ids: Optional[List[int]]):
+    subscription = hub.subscribe(user_id, event_ids)
+    try:
+        yield b"retry: 3000\n\n"
+        while True:
+            try:
+                message = await asyncio.wait_for(subscription.queue.get(), FEED_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                # Comment line: keeps proxies from closing an idle stream
+                yield b": ping\n\n"
+                continue
+            yield _sse(message["type"], serialization.dumps(message))
+    finally:
+        hub.unsubscribe(subscription)
+
+@router.get("/")
+async def stream_changes(
+    event_id: Optional[List[int]] = Query(None, description="Only these events; repeat the parameter for several"),
+    token: str = Depends(auth.oauth2_scheme),
+):
+    # Server-sent events for every event the caller can see
+    principal = await authenticate(token)
+    return StreamingResponse(
+        _event_stream(principal.id, event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.websocket("/ws")
+async def websocket_changes(websocket: WebSocket, token: Optional[str] = None, event_id: Optional[List[int]] = Query(None)):
+    # Browsers cannot set headers on a WebSocket, so the token may also come as ?token=
+    header = websocket.headers.get("authorization", "")
+    if not token and header.lower().startswith("bearer "):
+        token = header[7:]
+    try:
+        principal = await authenticate(token)
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    subscription = hub.subscribe(principal.id, event_id)
+
+    async def pump():
+        while True:
+            message = await subscription.queue.get()
+            await websocket.send_text(serialization.dumps(message).decode())
+
+    sender = asyncio.create_task(pump())
+    try:
+        # Incoming frames are ignored; this only waits for the client to go away
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+    finally:
+        sender.cancel()
+        hub.unsubscribe(subscription)
@@ -0,0 +1,122 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import or_, select
+from sqlalchemy.orm import Session
+from typing import Iterable, List
+
+from . import models, schemas, database, auth, access, admission, bulk, etags, intervals
+
+router = APIRouter(prefix="/api/groups", tags=["Groups"])
+
+# ---------- Helpers ----------
+def require_users(db: Session, user_ids: Iterable[int]):
+    user_ids = set(user_ids)
+    found = {user_id for (user_id,) in db.query(models.User.id).filter(models.User.id.in_(user_ids))}
+    missing = sorted(user_ids - found)
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Users not found: {missing}")
+
+def require_groups(db: Session, group_ids: Iterable[int]):
+    group_ids = set(group_ids)
+    found = {group_id for (group_id,) in db.query(models.Group.id).filter(models.Group.id.in_(group_ids))}
+    missing = sorted(group_ids - found)
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Groups not found: {missing}")
+
+def member_ids(db: Session, group_ids: Iterable[int]) -> List[int]:
+    members = select(models.GroupMember.user_id).where(models.GroupMember.group_id.in_(list(group_ids)))
+    return list(db.scalars(members.distinct()))
+
+def forget_users(user_ids: Iterable[int]):
+    # A user's reach changed without any per-event row changing: drop their cached masks and trees
+    user_ids = set(user_ids)
+    access.invalidate_users(user_ids)
+    intervals.invalidate_users(user_ids)
+
+def get_group(db: Session, group_id: int) -> models.Group:
+    group = db.query(models.Group).filter_by(id=group_id).first()
+    if not group:
+        raise HTTPException(status_code=404, detail="Group not found")
+    return group
+
+def require_owner(db: Session, group_id: int, user_id: int, detail: str) -> models.Group:
+    group = get_group(db, group_id)
+    if group.owner_id != user_id:
+        raise HTTPException(status_code=403, detail=detail)
+    return group
+
+# ---------- Create Group ----------
+@router.post("/", response_model=schemas.GroupOut, dependencies=[admission.max_items(admission.BATCH_MAX_ITEMS, field="member_ids")])
+@database.sync_handler
+def create_group(data: schemas.GroupCreate, db: Session = Depends(database.get_db), current_user: auth.Principal = Depends(auth.get_current_user)):
+    user_ids = list(dict.fromkeys(data.member_ids))
+    require_users(db, user_ids)
+    group = models.Group(name=data.name, owner_id=current_user.id)
+    db.add(group)
+    db.flush()
+    bulk.upsert(db, models.GroupMember, [{"group_id": group.id, "user_id": user_id} for user_id in user_ids], ["group_id", "user_id"])
+    db.commit()
+    return group
+
+# ---------- List Groups ----------
+@router.get("/", response_model=List[schemas.GroupOut])
+@database.sync_handler
+def list_groups(db: Session = Depends(auth.get_read_db), current_user: auth.Principal = Depends(auth.get_current_user)):
+    # Groups the caller owns or belongs to
+    memberships = select(models.GroupMember.group_id).where(models.GroupMember.user_id == current_user.id)
+    return (
+        db.query(models.Group)
+        .filter(or_(models.Group.owner_id == current_user.id, models.Group.id.in_(memberships)))
+        .order_by(models.Group.id)
+        .all()
+    )
+
+# ---------- Members ----------
+@router.get("/{group_id}/members", response_model=List[int])
+@database.sync_handler
+def list_members(group_id: int, db: Session = Depends(auth.get_read_db), current_user: auth.Principal = Depends(auth.get_current_user)):
+    group = get_group(db, group_id)
+    members = member_ids(db, [group_id])
+    if group.owner_id != current_user.id and current_user.id not in members:
+        raise HTTPException(status_code=403, detail="Not a member of this group")
+    return sorted(members)
+
+@router.post("/{group_id}/members", response_model=schemas.GroupOut, dependencies=[admission.max_items(admission.BATCH_MAX_ITEMS)])
+@database.sync_handler
+def add_members(group_id: int, user_ids: List[int], db: Session = Depends(database.get_db), current_user: auth.Principal = Depends(auth.get_current_user)):
+    group = require_owner(db, group_id, current_user.id, "Only the group owner can add members")
+    user_ids = list(dict.fromkeys(user_ids))
+    require_users(db, user_ids)
+    # Existing members are left as they are; no per-event row is written
+    bulk.upsert(db, models.GroupMember, [{"group_id": group_id, "user_id": user_id} for user_id in user_ids], ["group_id", "user_id"])
+    etags.bump_users(db, user_ids)
+    db.commit()
+    forget_users(user_ids)
+    return group
+
+@router.delete("/{group_id}/members/{user_id}", status_code=204)
+@database.sync_handler
+def remove_member(group_id: int, user_id: int, db: Session = Depends(database.get_db), current_user: auth.Principal = Depends(auth.get_current_user)):
+    group = get_group(db, group_id)
+    # Owners remove anyone; members may leave
+    if group.owner_id != current_user.id and user_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Only the group owner can remove members")
+    member = db.query(models.GroupMember).filter_by(group_id=group_id, user_id=user_id).first()
+    if not member:
+        raise HTTPException(status_code=404, detail="Member not found")
+    db.delete(member)
+    etags.bump_users(db, [user_id])
+    db.commit()
+    forget_users([user_id])
+
+# ---------- Delete Group ----------
+@router.delete("/{group_id}", status_code=204)
+@database.sync_handler
+def delete_group(group_id: int, db: Session = Depends(database.get_db), current_user: auth.Principal = Depends(auth.get_current_user)):
+    require_owner(db, group_id, current_user.id, "Only the group owner can delete the group")
+    members = member_ids(db, [group_id])
+    etags.bump_groups(db, [group_id])
+    for model in (models.GroupPermission, models.GroupMember):
+        db.query(model).filter(model.group_id == group_id).delete(synchronize_session=False)
+    db.query(models.Group).filter_by(id=group_id).delete(synchronize_session=False)
+    db.commit()
+    forget_users(members)
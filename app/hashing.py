@@ -0,0 +1,110 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+
+from . import utils
+
+# bcrypt runs in its own processes so a login storm neither blocks request threads nor holds the GIL.
+# HASH_WORKERS=0 hashes on the threadpool instead (useful for tests and single-core hosts).
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", min(4, os.cpu_count() or 1)))
+HASH_QUEUE_LIMIT = int(os.getenv("HASH_QUEUE_LIMIT", 32))
+HASH_RETRY_AFTER = int(os.getenv("HASH_RETRY_AFTER", 1))
+HASH_BATCH_SLICE = int(os.getenv("HASH_BATCH_SLICE", 8))
+
+_executor = None
+_inflight = 0
+
+class HashMetrics:
+    def __init__(self):
+        self.calls = 0
+        self.rejected = 0
+        self.hash_seconds = 0.0
+        self.wait_seconds = 0.0
+        self.max_hash_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def record(self, wait: float, elapsed: float):
+        self.calls += 1
+        self.wait_seconds += wait
+        self.hash_seconds += elapsed
+        self.max_wait_seconds = max(self.max_wait_seconds, wait)
+        self.max_hash_seconds = max(self.max_hash_seconds, elapsed)
+
+    def stats(self) -> dict:
+        calls = self.calls or 1
+        return {
+            "workers": HASH_WORKERS,
+            "queue_limit": HASH_QUEUE_LIMIT,
+            "inflight": _inflight,
+            "calls": self.calls,
+            "rejected": self.rejected,
+            "avg_hash_ms": round(self.hash_seconds / calls * 1000, 2),
+            "max_hash_ms": round(self.max_hash_seconds * 1000, 2),
+            "avg_wait_ms": round(self.wait_seconds / calls * 1000, 2),
+            "max_wait_ms": round(self.max_wait_seconds * 1000, 2),
+        }
+
+metrics = HashMetrics()
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=HASH_WORKERS)
+    return _executor
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+def _timed(fn, *args):
+    started = time.time()
+    result = fn(*args)
+    return started, result, time.time()
+
+async def _run(fn, *args):
+    global _inflight
+    if _inflight >= HASH_WORKERS + HASH_QUEUE_LIMIT:
+        metrics.rejected += 1
+        raise HTTPException(status_code=503, detail="Server busy, try again shortly", headers={"Retry-After": str(HASH_RETRY_AFTER)})
+    _inflight += 1
+    submitted = time.time()
+    try:
+        if HASH_WORKERS > 0:
+            started, result, finished = await asyncio.get_running_loop().run_in_executor(_get_executor(), _timed, fn, *args)
+        else:
+            started, result, finished = await run_in_threadpool(_timed, fn, *args)
+    finally:
+        _inflight -= 1
+    metrics.record(max(0.0, started - submitted), finished - started)
+    return result
+
+async def hash_password(password: str) -> str:
+    return await _run(utils.hash_password, password)
+
+def _hash_many(passwords: List[str]) -> List[str]:
+    return [utils.hash_password(password) for password in passwords]
+
+async def hash_passwords(passwords: List[str]) -> List[str]:
+    # Bulk provisioning: slices of HASH_BATCH_SLICE passwords run on every worker at once, but only one
+    # slice per worker is queued at a time, so logins keep interleaving instead of waiting for the batch
+    slices = [passwords[start:start + HASH_BATCH_SLICE] for start in range(0, len(passwords), HASH_BATCH_SLICE)]
+    hashed: List[List[str]] = [[] for _ in slices]
+    workers = asyncio.Semaphore(max(1, HASH_WORKERS))
+
+    async def hash_slice(index: int):
+        async with workers:
+            hashed[index] = await _run(_hash_many, slices[index])
+
+    await asyncio.gather(*(hash_slice(index) for index in range(len(slices))))
+    return [hash_ for slice_ in hashed for hash_ in slice_]
+
+async def verify_password(plain_password: str, hashed_password: str):
+    # Returns (valid, new_hash); new_hash is set when the stored hash uses outdated pwd_context settings
+    return await _run(utils.verify_and_update_password, plain_password, hashed_password)
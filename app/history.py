@@ -1,36 +1,86 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import func
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
+from datetime import datetime
 
-from . import models, schemas, database, auth
+from . import models, schemas, database, auth, access, etags, feed, intervals, pagination, recurrence, serialization, versioning
 
-router = APIRouter(prefix="/api/events", tags=["Version History & Diff"])
+HISTORY_OUT_FIELDS = list(schemas.EventHistoryOut.__fields__)
 
-def get_db():
-    db = database.SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+router = APIRouter(prefix="/api/events", tags=["Version History & Diff"])
 
 # ---------- Get Event History ----------
 @router.get("/{event_id}/changelog", response_model=List[schemas.EventHistoryOut])
-def get_changelog(event_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
-    permission = db.query(models.Permission).filter_by(user_id=current_user.id, event_id=event_id).first()
-    if not permission:
-        raise HTTPException(status_code=403, detail="Access denied")
-
-    history = db.query(models.EventHistory).filter_by(event_id=event_id).order_by(models.EventHistory.timestamp.desc()).all()
-    return history
+@database.sync_handler
+def get_changelog(
+    event_id: int,
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1),
+    cursor: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    stream: bool = False,
+    fields: Optional[str] = Query(None, description="Comma-separated subset of version fields to return"),
+    db: Session = Depends(auth.get_read_db),
+    current_user: auth.Principal = Depends(auth.get_current_user),
+):
+    access.require(db, current_user.id, event_id, access.CAN_VIEW, "Access denied")
+    History = models.EventHistory
+    selected = serialization.parse_fields(fields, HISTORY_OUT_FIELDS)
+
+    if stream:
+        # NDJSON, newest first, read through a server-side cursor
+        low_id = 0
+        if since is not None:
+            low_id = db.query(func.min(History.id)).filter(History.event_id == event_id, History.timestamp >= since).scalar()
+            if low_id is None:
+                return StreamingResponse(iter(()), media_type="application/x-ndjson")
+        head = versioning.head_state(db, event_id)
+        # Streamed from the same primary or replica the head state came from
+        return StreamingResponse(
+            versioning.stream_versions(event_id, head, low_id, since, until, selected, database.session_factories(db)),
+            media_type="application/x-ndjson",
+        )
+
+    # Every history entry bumps the event version, so it identifies the changelog state
+    version = db.query(models.Event.version).filter_by(id=event_id).scalar()
+    if version is None:
+        raise HTTPException(status_code=404, detail="Event not found")
+    etag = etags.make_etag("h", event_id, version, request)
+    cached = etags.not_modified(request, etag)
+    if cached:
+        return cached
+
+    query = db.query(History.id).filter(History.event_id == event_id)
+    if since is not None:
+        query = query.filter(History.timestamp >= since)
+    if until is not None:
+        query = query.filter(History.timestamp < until)
+    if cursor:
+        query = query.filter(pagination.before_cursor(History.timestamp, History.id, cursor))
+    query = query.order_by(History.timestamp.desc(), History.id.desc())
+    if limit:
+        query = query.limit(limit)
+
+    ids = [row.id for row in query]
+    if not ids:
+        return serialization.FastJSONResponse([], headers={"ETag": etag})
+    versions = versioning.rebuild(db, event_id, low_id=min(ids), high_id=max(ids))
+    page = [versions[version_id] for version_id in ids]
+    headers = {"ETag": etag}
+    if limit and len(page) == limit:
+        headers[pagination.NEXT_CURSOR_HEADER] = pagination.encode_cursor(page[-1]["timestamp"], page[-1]["id"])
+    return serialization.FastJSONResponse([{name: version[name] for name in selected} for version in page], headers=headers)
 
 # ---------- Get Specific Version ----------
 @router.get("/{event_id}/history/{version_id}", response_model=schemas.EventHistoryOut)
-def get_version(event_id: int, version_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
-    permission = db.query(models.Permission).filter_by(user_id=current_user.id, event_id=event_id).first()
-    if not permission:
-        raise HTTPException(status_code=403, detail="Access denied")
+@database.sync_handler
+def get_version(event_id: int, version_id: int, db: Session = Depends(auth.get_read_db), current_user: auth.Principal = Depends(auth.get_current_user)):
+    access.require(db, current_user.id, event_id, access.CAN_VIEW, "Access denied")
 
-    version = db.query(models.EventHistory).filter_by(id=version_id, event_id=event_id).first()
+    version = versioning.rebuild(db, event_id, low_id=version_id, high_id=version_id).get(version_id)
     if not version:
         raise HTTPException(status_code=404, detail="Version not found")
 
@@ -38,68 +88,82 @@ def get_version(event_id: int, version_id: int, db: Session = Depends(get_db), c
 
 # ---------- Rollback to Previous Version ----------
 @router.post("/{event_id}/rollback/{version_id}", response_model=schemas.EventOut)
-def rollback_event(event_id: int, version_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
-    permission = db.query(models.Permission).filter_by(user_id=current_user.id, event_id=event_id).first()
-    if not permission or permission.role not in ("Owner", "Editor"):
-        raise HTTPException(status_code=403, detail="Insufficient permissions")
+@database.sync_handler
+def rollback_event(event_id: int, version_id: int, request: Request, response: Response, db: Session = Depends(database.get_db), current_user: auth.Principal = Depends(auth.get_current_user)):
+    access.require(db, current_user.id, event_id, access.CAN_EDIT, "Insufficient permissions")
 
-    version = db.query(models.EventHistory).filter_by(id=version_id, event_id=event_id).first()
+    version = versioning.rebuild(db, event_id, low_id=version_id, high_id=version_id).get(version_id)
     if not version:
         raise HTTPException(status_code=404, detail="Version not found")
 
     event = db.query(models.Event).filter_by(id=event_id).first()
     if not event:
         raise HTTPException(status_code=404, detail="Event not found")
+    etags.require_match(request, etags.event_etag(event))
 
     # Save current state
-    backup = models.EventHistory(
-        event_id=event.id,
-        title=event.title,
-        description=event.description,
-        start_time=event.start_time,
-        end_time=event.end_time,
-        location=event.location,
-        recurrence_pattern=event.recurrence_pattern,
-        changed_by=current_user.id
-    )
-    db.add(backup)
+    restored = {field: version[field] for field in versioning.HISTORY_FIELDS}
+    versioning.record_change(db, event, restored, current_user.id)
+    previous = recurrence.schedule_key(event)
 
     # Restore
-    event.title = version.title
-    event.description = version.description
-    event.start_time = version.start_time
-    event.end_time = version.end_time
-    event.location = version.location
-    event.recurrence_pattern = version.recurrence_pattern
+    for attr, value in restored.items():
+        setattr(event, attr, value)
+    rescheduled = recurrence.reindex_event(db, event, previous)
+    etags.bump_event(db, event_id)
+    db.flush()
+    feed.notify(db, "event.rolled_back", {event_id: {"version": event.version, "restored_version": version_id}}, current_user.id)
 
     db.commit()
+    if rescheduled:
+        intervals.invalidate_event(event_id)
     db.refresh(event)
+    response.headers["ETag"] = etags.event_etag(event)
     return event
 
 # ---------- Get Field-by-Field Diff ----------
 @router.get("/{event_id}/diff/{v1}/{v2}", response_model=List[schemas.DiffResponse])
-def get_diff(event_id: int, v1: int, v2: int, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
-    permission = db.query(models.Permission).filter_by(user_id=current_user.id, event_id=event_id).first()
-    if not permission:
-        raise HTTPException(status_code=403, detail="Access denied")
+@database.sync_handler
+def get_diff(event_id: int, v1: int, v2: int, db: Session = Depends(auth.get_read_db), current_user: auth.Principal = Depends(auth.get_current_user)):
+    access.require(db, current_user.id, event_id, access.CAN_VIEW, "Access denied")
 
-    version1 = db.query(models.EventHistory).filter_by(id=v1, event_id=event_id).first()
-    version2 = db.query(models.EventHistory).filter_by(id=v2, event_id=event_id).first()
+    diff_list = versioning.diff_cache.get((event_id, v1, v2))
+    if diff_list is not None:
+        return diff_list
+
+    versions = versioning.rebuild(db, event_id, low_id=min(v1, v2), high_id=max(v1, v2))
+    version1 = versions.get(v1)
+    version2 = versions.get(v2)
 
     if not version1 or not version2:
         raise HTTPException(status_code=404, detail="One or both versions not found")
 
-    fields = ["title", "description", "start_time", "end_time", "location", "recurrence_pattern"]
-    diff_list = []
+    diff_list = versioning.diff_states(version1, version2)
+    versioning.diff_cache.set((event_id, v1, v2), diff_list)
+    return diff_list
 
-    for field in fields:
-        old = getattr(version1, field)
-        new = getattr(version2, field)
-        if old != new:
-            diff_list.append({
-                "field": field,
-                "old_value": str(old),
-                "new_value": str(new)
-            })
+# ---------- Get Consecutive Diffs for a Version Range ----------
+@router.get("/{event_id}/diff", response_model=List[schemas.VersionDiff])
+@database.sync_handler
+def get_range_diff(event_id: int, from_version: int, to_version: int, db: Session = Depends(auth.get_read_db), current_user: auth.Principal = Depends(auth.get_current_user)):
+    access.require(db, current_user.id, event_id, access.CAN_VIEW, "Access denied")
+    History = models.EventHistory
+
+    low, high = min(from_version, to_version), max(from_version, to_version)
+    ids = [row.id for row in db.query(History.id).filter(
+        History.event_id == event_id, History.id >= low, History.id <= high
+    ).order_by(History.id)]
+    if not ids or ids[0] != low or ids[-1] != high:
+        raise HTTPException(status_code=404, detail="One or both versions not found")
 
-    return diff_list
+    pairs = list(zip(ids, ids[1:]))
+    diffs = {pair: versioning.diff_cache.get((event_id, *pair)) for pair in pairs}
+    missing = [pair for pair, diff_list in diffs.items() if diff_list is None]
+    if missing:
+        # One load covers every uncached pair
+        versions = versioning.rebuild(db, event_id, low_id=missing[0][0], high_id=missing[-1][1])
+        for pair in missing:
+            diffs[pair] = versioning.diff_states(versions[pair[0]], versions[pair[1]])
+            versioning.diff_cache.set((event_id, *pair), diffs[pair])
+
+    return [{"from_version": v1, "to_version": v2, "changes": diffs[(v1, v2)]} for v1, v2 in pairs]
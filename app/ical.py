@@ -0,0 +1,180 @@
+import os
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Optional
+
+from . import recurrence
+
+ICAL_PRODID = os.getenv("ICAL_PRODID", "-//NeoFi//Event Management//EN")
+ICAL_UID_DOMAIN = os.getenv("ICAL_UID_DOMAIN", "neofi-events")
+
+# ---------- Writing (RFC 5545 subset) ----------
+def escape_text(value: str) -> str:
+    return value.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\r\n", "\\n").replace("\n", "\\n")
+
+def fold(line: str) -> str:
+    # Content lines are limited to 75 octets; continuation lines start with a space
+    encoded = line.encode("utf-8")
+    if len(encoded) <= 75:
+        return line + "\r\n"
+    parts, start, limit = [], 0, 75
+    while start < len(encoded):
+        end = min(start + limit, len(encoded))
+        # Never split inside a multi-byte character
+        while end < len(encoded) and (encoded[end] & 0xC0) == 0x80:
+            end -= 1
+        parts.append(encoded[start:end].decode("utf-8"))
+        start, limit = end, 74
+    return "\r\n ".join(parts) + "\r\n"
+
+def format_datetime(value: datetime) -> str:
+    # Event times are stored naive and written as floating local times; aware values as UTC
+    if value.tzinfo:
+        return value.astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    return value.strftime("%Y%m%dT%H%M%S")
+
+def rrule_text(pattern: str) -> str:
+    text = pattern.strip()
+    if text.upper().startswith("RRULE:"):
+        text = text[len("RRULE:"):]
+    return "FREQ=" + text.upper() if text.upper() in recurrence.FREQUENCIES else text.upper()
+
+def calendar_header() -> str:
+    return "BEGIN:VCALENDAR\r\nVERSION:2.0\r\n" + fold(f"PRODID:{ICAL_PRODID}") + "CALSCALE:GREGORIAN\r\n"
+
+def calendar_footer() -> str:
+    return "END:VCALENDAR\r\n"
+
+def format_event(row, stamp: datetime) -> str:
+    lines = [
+        "BEGIN:VEVENT",
+        f"UID:event-{row.id}@{ICAL_UID_DOMAIN}",
+        f"DTSTAMP:{format_datetime(stamp)}",
+        f"DTSTART:{format_datetime(row.start_time)}",
+        f"DTEND:{format_datetime(row.end_time)}",
+        f"SUMMARY:{escape_text(row.title)}",
+    ]
+    if row.description:
+        lines.append(f"DESCRIPTION:{escape_text(row.description)}")
+    if row.location:
+        lines.append(f"LOCATION:{escape_text(row.location)}")
+    if row.is_recurring and row.recurrence_pattern:
+        lines.append(f"RRULE:{rrule_text(row.recurrence_pattern)}")
+    if row.created_at:
+        lines.append(f"CREATED:{format_datetime(row.created_at.replace(tzinfo=row.created_at.tzinfo or timezone.utc))}")
+    lines.append("END:VEVENT")
+    return "".join(fold(line) for line in lines)
+
+# ---------- Reading ----------
+def unescape_text(value: str) -> str:
+    out, chars = [], iter(value)
+    for char in chars:
+        if char == "\\":
+            char = next(chars, "")
+            out.append("\n" if char in "nN" else char)
+        else:
+            out.append(char)
+    return "".join(out)
+
+def parse_datetime(value: str, params: dict) -> datetime:
+    # UTC ("Z") values become naive UTC; floating and TZID values keep their wall-clock time
+    if params.get("VALUE") == "DATE" or len(value) == 8:
+        day = datetime.strptime(value, "%Y%m%d").date()
+        return datetime.combine(day, datetime.min.time())
+    if value.endswith("Z"):
+        return datetime.strptime(value, "%Y%m%dT%H%M%SZ")
+    return datetime.strptime(value, "%Y%m%dT%H%M%S")
+
+def parse_duration(value: str) -> timedelta:
+    # [+-]P[nW][nD][T[nH][nM][nS]]
+    sign = -1 if value.startswith("-") else 1
+    value = value.lstrip("+-")
+    if not value.startswith("P"):
+        raise ValueError(f"Invalid DURATION: {value}")
+    units = {"W": "weeks", "D": "days", "H": "hours", "M": "minutes", "S": "seconds"}
+    parts, number = {}, ""
+    for char in value[1:]:
+        if char.isdigit():
+            number += char
+        elif char in units and number:
+            parts[units[char]] = int(number)
+            number = ""
+        elif char != "T":
+            raise ValueError(f"Invalid DURATION: {value}")
+    return sign * timedelta(**parts)
+
+def split_line(line: str):
+    # "NAME;PARAM=x;PARAM=y:value" -> ("NAME", {"PARAM": "x"}, "value")
+    head, _, value = line.partition(":")
+    name, *raw_params = head.split(";")
+    params = {}
+    for param in raw_params:
+        key, _, param_value = param.partition("=")
+        params[key.upper()] = param_value.strip('"')
+    return name.upper(), params, value
+
+def event_values(props: dict) -> dict:
+    # Properties of one VEVENT -> EventCreate fields; raises ValueError for unusable events
+    if "RECURRENCE-ID" in props:
+        raise ValueError("Overrides of single occurrences (RECURRENCE-ID) are not supported")
+    if "DTSTART" not in props:
+        raise ValueError("DTSTART is required")
+    start_params, start_value = props["DTSTART"]
+    start_time = parse_datetime(start_value, start_params)
+    if "DTEND" in props:
+        end_time = parse_datetime(props["DTEND"][1], props["DTEND"][0])
+    elif "DURATION" in props:
+        end_time = start_time + parse_duration(props["DURATION"][1])
+    else:
+        all_day = start_params.get("VALUE") == "DATE" or len(start_value) == 8
+        end_time = start_time + (timedelta(days=1) if all_day else timedelta())
+    rrule = props.get("RRULE", (None, None))[1]
+    return {
+        "title": unescape_text(props.get("SUMMARY", ({}, ""))[1]) or "(untitled)",
+        "description": unescape_text(props["DESCRIPTION"][1]) if "DESCRIPTION" in props else None,
+        "start_time": start_time,
+        "end_time": end_time,
+        "location": unescape_text(props["LOCATION"][1]) if "LOCATION" in props else None,
+        "is_recurring": bool(rrule),
+        "recurrence_pattern": rrule,
+    }
+
+async def iter_events(lines: AsyncIterator[str]) -> AsyncIterator[object]:
+    # Yields an EventCreate-shaped dict per VEVENT, or the ValueError that made it unusable.
+    # Only one event's properties are held at a time.
+    props: Optional[dict] = None
+    depth = 0
+    pending = None
+
+    async def unfolded():
+        nonlocal pending
+        async for line in lines:
+            if line[:1] in (" ", "\t") and pending is not None:
+                pending += line[1:]
+                continue
+            if pending is not None:
+                yield pending
+            pending = line
+        if pending is not None:
+            yield pending
+
+    async for line in unfolded():
+        if not line:
+            continue
+        name, params, value = split_line(line)
+        if name == "BEGIN" and value.upper() == "VEVENT":
+            props, depth = {}, 0
+        elif props is None:
+            continue
+        elif name == "BEGIN":
+            # Nested components (VALARM) are skipped
+            depth += 1
+        elif name == "END" and depth:
+            depth -= 1
+        elif name == "END" and value.upper() == "VEVENT":
+            try:
+                yield event_values(props)
+            except ValueError as exc:
+                yield exc
+            props = None
+        elif not depth and name not in props:
+            props[name] = (params, value)
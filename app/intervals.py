@@ -0,0 +1,139 @@
+import os
+from datetime import datetime, timezone
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from . import models, access
+from .cache import TTLCache
+
+AVAILABILITY_CACHE_SIZE = int(os.getenv("AVAILABILITY_CACHE_SIZE", 1000))
+AVAILABILITY_CACHE_TTL = float(os.getenv("AVAILABILITY_CACHE_TTL", 300))
+# Users with more occurrences than this are answered with range queries instead of a cached tree
+AVAILABILITY_TREE_MAX = int(os.getenv("AVAILABILITY_TREE_MAX", 50000))
+
+Interval = Tuple[datetime, datetime, int]
+
+# ---------- Interval tree ----------
+class IntervalTree:
+    # Static augmented tree: intervals sorted by start form an implicit balanced BST (the node for
+    # [lo, hi) is its midpoint) and max_end[mid] is the latest end anywhere in that subtree.
+    # Overlap queries cost O(log n + k).
+    def __init__(self, intervals: Iterable[Interval]):
+        self.items = sorted(intervals)
+        self.max_end: List[Optional[datetime]] = [None] * len(self.items)
+        self.event_ids = frozenset(item[2] for item in self.items)
+        self._build(0, len(self.items))
+
+    def __len__(self):
+        return len(self.items)
+
+    def _build(self, lo: int, hi: int) -> Optional[datetime]:
+        if lo >= hi:
+            return None
+        mid = (lo + hi) // 2
+        latest = self.items[mid][1]
+        for child in (self._build(lo, mid), self._build(mid + 1, hi)):
+            if child is not None and child > latest:
+                latest = child
+        self.max_end[mid] = latest
+        return latest
+
+    def overlaps(self, start: datetime, end: datetime, exclude_event_id: Optional[int] = None) -> List[Interval]:
+        # Intervals with item.start < end and item.end > start, ordered by start
+        found = []
+        stack = [(0, len(self.items))]
+        while stack:
+            lo, hi = stack.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            if self.max_end[mid] <= start:
+                continue
+            stack.append((lo, mid))
+            item = self.items[mid]
+            if item[0] < end:
+                if item[1] > start and item[2] != exclude_event_id:
+                    found.append(item)
+                # Everything to the right starts no earlier than this node
+                stack.append((mid + 1, hi))
+        found.sort()
+        return found
+
+# ---------- Per-user trees ----------
+# Keyed by user_id; built on first use and dropped by any write to one of the user's events
+tree_cache = TTLCache(AVAILABILITY_CACHE_SIZE, AVAILABILITY_CACHE_TTL)
+# Cached for users over AVAILABILITY_TREE_MAX so the size check is not repeated on every request
+TOO_LARGE = object()
+
+def invalidate_user(user_id: int):
+    tree_cache.pop(user_id)
+
+def invalidate_users(user_ids):
+    user_ids = set(user_ids)
+    tree_cache.discard_where(lambda user_id, _: user_id in user_ids)
+
+def invalidate_event(event_id: int):
+    tree_cache.discard_where(lambda _, tree: tree is not TOO_LARGE and event_id in tree.event_ids)
+
+def invalidate_events(event_ids):
+    event_ids = set(event_ids)
+    tree_cache.discard_where(lambda _, tree: tree is not TOO_LARGE and not tree.event_ids.isdisjoint(event_ids))
+
+def naive_utc(value: datetime) -> datetime:
+    # Event times are stored naive; aware inputs are converted to UTC first
+    return value.astimezone(timezone.utc).replace(tzinfo=None) if value.tzinfo else value
+
+def _occurrence_query(db: Session, user_id: int):
+    Occurrence = models.EventOccurrence
+    return (
+        db.query(Occurrence.start_time, Occurrence.end_time, Occurrence.event_id)
+        .filter(Occurrence.event_id.in_(access.visible_event_ids(user_id)))
+    )
+
+def range_tree(db: Session, user_id: int, start: datetime, end: datetime) -> IntervalTree:
+    # Fallback: an uncached tree over just the window, read through ix_event_occurrences_start_time_id
+    Occurrence = models.EventOccurrence
+    rows = _occurrence_query(db, user_id).filter(Occurrence.start_time < end, Occurrence.end_time > start).all()
+    return IntervalTree(tuple(row) for row in rows)
+
+def user_tree(db: Session, user_id: int) -> Optional[IntervalTree]:
+    tree = tree_cache.get(user_id)
+    if tree is not None:
+        return None if tree is TOO_LARGE else tree
+    generation = tree_cache.generation
+    rows = _occurrence_query(db, user_id).limit(AVAILABILITY_TREE_MAX + 1).all()
+    if len(rows) > AVAILABILITY_TREE_MAX:
+        tree_cache.set(user_id, TOO_LARGE, generation)
+        return None
+    tree = IntervalTree(tuple(row) for row in rows)
+    tree_cache.set(user_id, tree, generation)
+    return tree
+
+def tree_for(db: Session, user_id: int, start: datetime, end: datetime) -> IntervalTree:
+    tree = user_tree(db, user_id)
+    return tree if tree is not None else range_tree(db, user_id, start, end)
+
+# ---------- Free/busy ----------
+def busy_blocks(intervals: List[Interval], start: datetime, end: datetime) -> List[Tuple[datetime, datetime]]:
+    # Merges overlapping intervals (already ordered by start) and clips them to the window
+    blocks = []
+    for item_start, item_end, _ in intervals:
+        item_start, item_end = max(item_start, start), min(item_end, end)
+        if blocks and item_start <= blocks[-1][1]:
+            if item_end > blocks[-1][1]:
+                blocks[-1] = (blocks[-1][0], item_end)
+        else:
+            blocks.append((item_start, item_end))
+    return blocks
+
+def free_blocks(busy: List[Tuple[datetime, datetime]], start: datetime, end: datetime) -> List[Tuple[datetime, datetime]]:
+    free = []
+    cursor = start
+    for busy_start, busy_end in busy:
+        if busy_start > cursor:
+            free.append((cursor, busy_start))
+        cursor = max(cursor, busy_end)
+    if cursor < end:
+        free.append((cursor, end))
+    return free
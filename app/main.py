@@ -1,19 +1,34 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
+from sqlalchemy.orm.exc import StaleDataError
 
-from . import models, database
-from .auth import router as auth_router
+from . import models, database, access, admission, feed, hashing, intervals, metrics, pagination, versioning
+from .auth import router as auth_router, principal_cache
 from .events import router as event_router
 from .permissions import router as permission_router
 from .history import router as history_router
+from .availability import router as availability_router
+from .groups import router as group_router
+from .feed import router as feed_router
+from .users import router as user_router
 
-# Create tables
-models.Base.metadata.create_all(bind=database.engine)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Create tables
+    await database.init_db(models.Base.metadata)
+    await feed.start()
+    yield
+    await feed.stop()
+    hashing.shutdown()
 
 app = FastAPI(
     title="NeoFi Collaborative Event Management API",
     description="A FastAPI backend for event collaboration with roles, versioning, and history.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
 )
 
 # CORS setup
@@ -23,14 +38,49 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[pagination.NEXT_CURSOR_HEADER, "ETag"],
 )
+# Per-route latency and SQL counts, served at /metrics
+app.add_middleware(metrics.MetricsMiddleware)
+
+# An event UPDATE whose version guard matched no row: another writer committed first
+@app.exception_handler(StaleDataError)
+async def stale_data_handler(request: Request, exc: StaleDataError):
+    return JSONResponse(status_code=409, content={"detail": "Event was modified concurrently; reload it and retry"})
 
 # Include routers
 app.include_router(auth_router)
 app.include_router(event_router)
 app.include_router(permission_router)
 app.include_router(history_router)
+app.include_router(availability_router)
+app.include_router(group_router)
+app.include_router(feed_router)
+app.include_router(user_router)
 
 @app.get("/")
 def root():
     return {"message": "Welcome to the NeoFi Event Management Backend"}
+
+@app.get("/api/stats/cache")
+def cache_stats():
+    return {"permissions": access.cache.stats(), "principals": principal_cache.stats(), "diffs": versioning.diff_cache.stats(), "availability": intervals.tree_cache.stats()}
+
+# The hashing, admission, change feed and request counters have no locks: only async code on the event
+# loop changes them. Sync handlers on worker threads at most check whether the feed has subscribers,
+# and hand feed messages over with call_soon_threadsafe. So these handlers are async too and read them on the loop.
+@app.get("/api/stats/hashing")
+async def hashing_stats():
+    return hashing.metrics.stats()
+
+@app.get("/api/stats/admission")
+async def admission_stats():
+    return await admission.stats()
+
+@app.get("/api/stats/feed")
+async def feed_stats():
+    return feed.hub.stats()
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
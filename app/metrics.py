@@ -0,0 +1,167 @@
+import bisect
+import logging
+import os
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+
+from . import database
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+# Requests slower than this are logged with the SQL they ran; 0 turns the log off
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", 0))
+SLOW_REQUEST_MAX_SQL = int(os.getenv("SLOW_REQUEST_MAX_SQL", 50))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+logger = logging.getLogger(__name__)
+
+# ---------- Per-request counters ----------
+class RequestStats:
+    __slots__ = ("statements", "db_seconds", "sql")
+
+    def __init__(self, keep_sql: bool):
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.sql: Optional[List[Tuple[float, str]]] = [] if keep_sql else None
+
+# Copied into threadpool workers and greenlets, so DB work anywhere in the request lands here
+current: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current.get() is not None:
+        conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = current.get()
+    if stats is None:
+        return
+    started = conn.info.get("metrics_started")
+    elapsed = time.perf_counter() - started.pop() if started else 0.0
+    stats.statements += 1
+    stats.db_seconds += elapsed
+    if stats.sql is not None and len(stats.sql) < SLOW_REQUEST_MAX_SQL:
+        stats.sql.append((elapsed, statement))
+
+def instrument(engine):
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+# ---------- Aggregates ----------
+class Histogram:
+    __slots__ = ("buckets", "counts", "total", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+class RouteMetrics:
+    __slots__ = ("latency", "statements", "db_seconds", "statuses")
+
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.statements = Histogram(STATEMENT_BUCKETS)
+        self.db_seconds = 0.0
+        self.statuses: Dict[int, int] = {}
+
+# (method, route template) -> RouteMetrics
+routes: Dict[Tuple[str, str], RouteMetrics] = {}
+
+def record(method: str, route: str, status: int, elapsed: float, stats: RequestStats):
+    key = (method, route)
+    entry = routes.get(key)
+    if entry is None:
+        entry = routes[key] = RouteMetrics()
+    entry.latency.observe(elapsed)
+    entry.statements.observe(stats.statements)
+    entry.db_seconds += stats.db_seconds
+    entry.statuses[status] = entry.statuses.get(status, 0) + 1
+    if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+        lines = "".join(f"\n  [{sql_elapsed * 1000:.1f} ms] {' '.join(sql.split())}" for sql_elapsed, sql in stats.sql or [])
+        logger.warning(
+            "slow request %s %s -> %s in %.1f ms (%d statements, %.1f ms in the database)%s",
+            method, route, status, elapsed * 1000, stats.statements, stats.db_seconds * 1000, lines,
+        )
+
+def route_template(scope) -> str:
+    # The matched path template keeps label cardinality bounded; unmatched paths share one label
+    route = scope.get("route")
+    return getattr(route, "path", None) or "<unmatched>"
+
+# ---------- Middleware ----------
+class MetricsMiddleware:
+    # Plain ASGI rather than BaseHTTPMiddleware: no extra task per request, and streaming bodies are timed to the last chunk
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats(keep_sql=bool(SLOW_REQUEST_MS))
+        token = current.set(stats)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current.reset(token)
+            record(scope["method"], route_template(scope), status, time.perf_counter() - started, stats)
+
+# ---------- Prometheus exposition ----------
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(**labels) -> str:
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+def _histogram_lines(name: str, histogram: Histogram, labels: dict) -> List[str]:
+    lines, cumulative = [], 0
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        cumulative += count
+        lines.append(f"{name}_bucket{_labels(**labels, le=bound)} {cumulative}")
+    lines.append(f"{name}_bucket{_labels(**labels, le='+Inf')} {histogram.count}")
+    lines.append(f"{name}_sum{_labels(**labels)} {histogram.total}")
+    lines.append(f"{name}_count{_labels(**labels)} {histogram.count}")
+    return lines
+
+def render() -> str:
+    lines = [
+        "# HELP http_request_duration_seconds Request latency by route, including streamed bodies.",
+        "# TYPE http_request_duration_seconds histogram",
+    ]
+    snapshot = sorted(routes.items())
+    for (method, route), entry in snapshot:
+        lines += _histogram_lines("http_request_duration_seconds", entry.latency, {"method": method, "route": route})
+    lines += ["# HELP http_requests_total Requests by route and status code.", "# TYPE http_requests_total counter"]
+    for (method, route), entry in snapshot:
+        for status, count in sorted(entry.statuses.items()):
+            lines.append(f"http_requests_total{_labels(method=method, route=route, status=status)} {count}")
+    lines += ["# HELP db_statements_per_request SQL statements executed per request.", "# TYPE db_statements_per_request histogram"]
+    for (method, route), entry in snapshot:
+        lines += _histogram_lines("db_statements_per_request", entry.statements, {"method": method, "route": route})
+    lines += ["# HELP db_time_seconds_total Time spent executing SQL, by route.", "# TYPE db_time_seconds_total counter"]
+    for (method, route), entry in snapshot:
+        lines.append(f"db_time_seconds_total{_labels(method=method, route=route)} {entry.db_seconds}")
+    return "\n".join(lines) + "\n"
+
+if METRICS_ENABLED:
+    for engine in database.sync_engines():
+        instrument(engine)
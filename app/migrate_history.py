@@ -0,0 +1,87 @@
+"""Convert event_histories to delta encoding.
+
+Adds the seq/changes columns and the (event_id, id) index when missing, then rewrites each
+event's history so only every HISTORY_SNAPSHOT_INTERVAL-th version keeps a full copy.
+Safe to re-run: states are rebuilt from whatever mix of full and delta rows is present.
+
+    python -m app.migrate_history [--dry-run]
+"""
+import argparse
+
+from sqlalchemy import inspect, text
+
+from . import database, models, versioning
+
+History = models.EventHistory
+
+def add_columns(engine):
+    columns = {column["name"] for column in inspect(engine).get_columns(History.__tablename__)}
+    with engine.begin() as conn:
+        for name in ("seq", "changes"):
+            if name not in columns:
+                column_type = History.__table__.c[name].type.compile(dialect=engine.dialect)
+                conn.execute(text(f"ALTER TABLE {History.__tablename__} ADD COLUMN {name} {column_type}"))
+        for index in History.__table__.indexes:
+            index.create(bind=conn, checkfirst=True)
+
+def row_states(rows, head_state):
+    # Full state of every row, newest first walk; None when a delta has nothing to apply to
+    states = {}
+    state = head_state
+    for row in reversed(rows):
+        if row.changes is not None and state is None:
+            return None
+        state = versioning.apply_row(state, row)
+        states[row.id] = state
+    return states
+
+def migrate_event(db, event_id: int) -> bool:
+    rows = db.query(History).filter(History.event_id == event_id).order_by(History.id).all()
+    event = db.query(models.Event).filter_by(id=event_id).first()
+    head_state = versioning.event_state(event) if event else None
+    states = row_states(rows, head_state)
+    if states is None:
+        return False
+
+    for index, row in enumerate(rows):
+        row.seq = index + 1
+        state = states[row.id]
+        next_state = states[rows[index + 1].id] if index + 1 < len(rows) else head_state
+        # The newest row of a deleted event has nothing after it to diff against, so it stays full
+        if row.seq % versioning.HISTORY_SNAPSHOT_INTERVAL == 0 or next_state is None:
+            row.changes = None
+            for field in versioning.HISTORY_FIELDS:
+                setattr(row, field, state[field])
+        else:
+            changed = {field: state[field] for field in versioning.HISTORY_FIELDS if state[field] != next_state[field]}
+            row.changes = versioning.encode_changes(changed)
+            for field in versioning.HISTORY_FIELDS:
+                setattr(row, field, None)
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="rewrite in a transaction that is rolled back")
+    args = parser.parse_args()
+
+    add_columns(database.engine)
+    db = database.SessionLocal()
+    migrated = skipped = 0
+    try:
+        # Rows detached from a deleted event (event_id NULL) have no chain to encode against and stay as they are
+        event_ids = [event_id for (event_id,) in db.query(History.event_id).filter(History.event_id.isnot(None)).distinct()]
+        for event_id in event_ids:
+            if migrate_event(db, event_id):
+                migrated += 1
+            else:
+                skipped += 1
+            if args.dry_run:
+                db.rollback()
+            else:
+                db.commit()
+    finally:
+        db.close()
+    print(f"migrated {migrated} events, skipped {skipped} (history without a reachable full state)")
+
+if __name__ == "__main__":
+    main()
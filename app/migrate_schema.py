@@ -0,0 +1,70 @@
+"""Add the columns and indexes newer models expect to an existing database.
+
+create_all only creates missing tables, so tables created by an earlier release keep their old
+shape. This adds the missing columns with their server defaults and the missing indexes. Before
+ix_permissions_user_event becomes unique, duplicate (user_id, event_id) shares are reduced to the
+newest row. Safe to re-run: anything already present is left alone.
+
+    python -m app.migrate_schema
+"""
+import argparse
+
+from sqlalchemy import inspect, text
+
+from . import database, models
+
+COLUMNS = [
+    (models.Event, "version"),
+    (models.User, "listing_version"),
+]
+
+def add_columns(engine):
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for model, name in COLUMNS:
+            table = model.__table__
+            if name in {column["name"] for column in inspector.get_columns(table.name)}:
+                continue
+            column = table.c[name]
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {name} {column.type.compile(dialect=engine.dialect)}"
+            # Existing rows take the server default, so NOT NULL holds from the start
+            if column.server_default is not None:
+                ddl += f" DEFAULT {column.server_default.arg}"
+            if not column.nullable:
+                ddl += " NOT NULL"
+            conn.execute(text(ddl))
+            print(f"added {table.name}.{name}")
+
+def dedupe_permissions(engine):
+    # The newest share of a pair wins, as it does for a user listed twice in one share request
+    Permission = models.Permission.__table__
+    with engine.begin() as conn:
+        removed = conn.execute(text(
+            f"DELETE FROM {Permission.name} WHERE id NOT IN "
+            f"(SELECT max(id) FROM {Permission.name} GROUP BY user_id, event_id)"
+        )).rowcount
+    if removed:
+        print(f"removed {removed} duplicate permissions")
+
+def add_indexes(engine):
+    unique = {index.name for index in models.Permission.__table__.indexes if index.unique}
+    stale = [index["name"] for index in inspect(engine).get_indexes(models.Permission.__tablename__) if index["name"] in unique and not index["unique"]]
+    with engine.begin() as conn:
+        # Created without UNIQUE by an earlier release
+        for name in stale:
+            conn.execute(text(f"DROP INDEX {name}"))
+        for model in (models.Event, models.Permission):
+            for index in model.__table__.indexes:
+                index.create(bind=conn, checkfirst=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.parse_args()
+
+    add_columns(database.engine)
+    dedupe_permissions(database.engine)
+    add_indexes(database.engine)
+    print("schema is up to date")
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,8 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Boolean, Text, Enum
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Boolean, Text, Enum, Index, JSON
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from .database import Base
+from datetime import datetime, timezone
 import enum
 
 class RoleEnum(str, enum.Enum):
@@ -15,6 +16,9 @@ class User(Base):
     username = Column(String(50), unique=True, index=True, nullable=False)
     email = Column(String(100), unique=True, nullable=False)
     hashed_password = Column(String, nullable=False)
+    # Bumped whenever an event this user can see is created, changed, shared or removed;
+    # backs the ETag of GET /api/events
+    listing_version = Column(Integer, nullable=False, default=1, server_default="1")
 
     events = relationship("Event", back_populates="creator")
     permissions = relationship("Permission", back_populates="user")
@@ -29,13 +33,25 @@ class Event(Base):
     location = Column(String, nullable=True)
     is_recurring = Column(Boolean, default=False)
     recurrence_pattern = Column(String, nullable=True)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Stamped here rather than by the database (SQLite's is whole seconds) so as_of reads compare at full precision
+    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), server_default=func.now())
+    # Incremented with every history entry; UPDATEs are guarded by it (optimistic concurrency)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
 
     creator_id = Column(Integer, ForeignKey("users.id"))
     creator = relationship("User", back_populates="events")
 
     permissions = relationship("Permission", back_populates="event")
+    group_permissions = relationship("GroupPermission", back_populates="event")
     histories = relationship("EventHistory", back_populates="event")
+    occurrences = relationship("EventOccurrence", back_populates="event")
+
+    __table_args__ = (
+        # Keyset pagination order for GET /api/events
+        Index("ix_events_start_time_id", "start_time", "id"),
+    )
+    # The version is set by versioning.record_change, not generated per flush
+    __mapper_args__ = {"version_id_col": version, "version_id_generator": False}
 
 class Permission(Base):
     __tablename__ = "permissions"
@@ -47,6 +63,49 @@ class Permission(Base):
     user = relationship("User", back_populates="permissions")
     event = relationship("Event", back_populates="permissions")
 
+    __table_args__ = (
+        # Conflict target of the share upsert
+        Index("ix_permissions_user_event", "user_id", "event_id", unique=True),
+    )
+
+class Group(Base):
+    __tablename__ = "user_groups"
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(100), nullable=False)
+    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    members = relationship("GroupMember", back_populates="group")
+    permissions = relationship("GroupPermission", back_populates="group")
+
+class GroupMember(Base):
+    __tablename__ = "group_members"
+    group_id = Column(Integer, ForeignKey("user_groups.id"), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+
+    group = relationship("Group", back_populates="members")
+
+    __table_args__ = (
+        # Resolves a user's groups when checking access
+        Index("ix_group_members_user_group", "user_id", "group_id"),
+    )
+
+class GroupPermission(Base):
+    # One row shares an event with every member of a group; membership changes never touch it
+    __tablename__ = "group_permissions"
+    id = Column(Integer, primary_key=True, index=True)
+    group_id = Column(Integer, ForeignKey("user_groups.id"), nullable=False)
+    event_id = Column(Integer, ForeignKey("events.id"))
+    role = Column(Enum(RoleEnum), default=RoleEnum.viewer)
+
+    group = relationship("Group", back_populates="permissions")
+    event = relationship("Event", back_populates="group_permissions")
+
+    __table_args__ = (
+        Index("ix_group_permissions_group_event", "group_id", "event_id", unique=True),
+        Index("ix_group_permissions_event", "event_id"),
+    )
+
 class EventHistory(Base):
     __tablename__ = "event_histories"
     id = Column(Integer, primary_key=True, index=True)
@@ -59,5 +118,42 @@ class EventHistory(Base):
     location = Column(String)
     recurrence_pattern = Column(String)
     changed_by = Column(Integer, ForeignKey("users.id"))
+    # Per-event version number; every HISTORY_SNAPSHOT_INTERVAL-th row is a full snapshot
+    seq = Column(Integer)
+    # Old values of the fields this change touched; NULL marks a full snapshot row
+    changes = Column(JSON(none_as_null=True), nullable=True)
 
     event = relationship("Event", back_populates="histories")
+
+    __table_args__ = (
+        Index("ix_event_histories_event_id_id", "event_id", "id"),
+        # Changelog keyset pagination and since/until bounds
+        Index("ix_event_histories_event_id_timestamp", "event_id", "timestamp", "id"),
+    )
+
+class EventOccurrence(Base):
+    # Materialized expansion of each event's schedule, maintained by app/recurrence.py
+    __tablename__ = "event_occurrences"
+    id = Column(Integer, primary_key=True, index=True)
+    event_id = Column(Integer, ForeignKey("events.id"), nullable=False, index=True)
+    start_time = Column(DateTime, nullable=False)
+    end_time = Column(DateTime, nullable=False)
+
+    event = relationship("Event", back_populates="occurrences")
+
+    __table_args__ = (
+        Index("ix_event_occurrences_start_time_id", "start_time", "id"),
+    )
+
+class FeedMessage(Base):
+    # Change notifications shared by workers when FEED_BROKER=database; pruned after FEED_RETENTION_SECONDS
+    __tablename__ = "feed_messages"
+    id = Column(Integer, primary_key=True)
+    payload = Column(JSON, nullable=False)
+    created_at = Column(DateTime, nullable=False, index=True)
+
+class RevokedToken(Base):
+    __tablename__ = "revoked_tokens"
+    jti = Column(String(64), primary_key=True)
+    expires_at = Column(DateTime, nullable=False, index=True)
+    revoked_at = Column(DateTime, nullable=False, index=True)
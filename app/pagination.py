@@ -0,0 +1,44 @@
+import base64
+import json
+from datetime import datetime
+from typing import Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import tuple_
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+# Opaque keyset cursor: the (sort value, id) of the last row on the previous page
+def encode_cursor(sort_value: datetime, row_id: int) -> str:
+    raw = json.dumps([sort_value.isoformat(), row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        sort_value, row_id = json.loads(raw)
+        return datetime.fromisoformat(sort_value), int(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+# Ranked results (search) have no stable keyset; their cursor carries the offset of the next page
+def encode_offset_cursor(offset: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps(["offset", offset]).encode()).decode().rstrip("=")
+
+def decode_offset_cursor(cursor: str) -> int:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        kind, offset = json.loads(raw)
+        if kind != "offset" or int(offset) < 0:
+            raise ValueError(kind)
+        return int(offset)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def after_cursor(sort_column, id_column, cursor: str):
+    sort_value, row_id = decode_cursor(cursor)
+    return tuple_(sort_column, id_column) > tuple_(sort_value, row_id)
+
+def before_cursor(sort_column, id_column, cursor: str):
+    sort_value, row_id = decode_cursor(cursor)
+    return tuple_(sort_column, id_column) < tuple_(sort_value, row_id)
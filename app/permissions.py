@@ -1,77 +1,121 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 
-from . import models, schemas, database, auth
+from . import models, schemas, database, auth, access, admission, bulk, etags, feed, groups, intervals, serialization
 
-router = APIRouter(prefix="/api/events", tags=["Permissions"])
+PERMISSION_FIELDS = list(schemas.PermissionOut.__fields__)
 
-def get_db():
-    db = database.SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+router = APIRouter(prefix="/api/events", tags=["Permissions"])
 
 # ------------- Share Event with Users -------------
-@router.post("/{event_id}/share", response_model=List[schemas.PermissionOut])
-def share_event(event_id: int, share_data: List[schemas.ShareUser], db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
+@router.post("/{event_id}/share", response_model=List[schemas.PermissionOut], dependencies=[admission.max_items(admission.BATCH_MAX_ITEMS)])
+@database.sync_handler
+def share_event(event_id: int, share_data: List[schemas.ShareUser], db: Session = Depends(database.get_db), current_user: auth.Principal = Depends(auth.get_current_user)):
     # Ensure current user is Owner
-    owner_perm = db.query(models.Permission).filter_by(user_id=current_user.id, event_id=event_id, role="Owner").first()
-    if not owner_perm:
-        raise HTTPException(status_code=403, detail="Only owner can share event")
-
-    result = []
-    for item in share_data:
-        # Prevent duplicate sharing
-        perm = db.query(models.Permission).filter_by(user_id=item.user_id, event_id=event_id).first()
-        if perm:
-            perm.role = item.role
-        else:
-            perm = models.Permission(user_id=item.user_id, event_id=event_id, role=item.role)
-            db.add(perm)
-        result.append(perm)
+    access.require(db, current_user.id, event_id, access.CAN_SHARE, "Only owner can share event")
+
+    # One upsert on (user_id, event_id) instead of a lookup per user; a user listed twice gets the last role
+    roles = {item.user_id: models.RoleEnum(item.role.value) for item in share_data}
+    groups.require_users(db, roles)
+    rows = [{"user_id": user_id, "event_id": event_id, "role": role} for user_id, role in roles.items()]
+    bulk.upsert(db, models.Permission, rows, ["user_id", "event_id"], ["role"])
+
+    etags.bump_users(db, roles)
+    feed.notify(db, "permissions.changed", {event_id: {}}, current_user.id)
+    db.commit()
+    for user_id in roles:
+        access.invalidate(user_id, event_id)
+    intervals.invalidate_users(roles)
+    return rows
+
+# ------------- Share Event with Groups -------------
+@router.post("/{event_id}/share/groups", response_model=List[schemas.GroupPermissionOut], dependencies=[admission.max_items(admission.BATCH_MAX_ITEMS)])
+@database.sync_handler
+def share_event_with_groups(event_id: int, share_data: List[schemas.ShareGroup], db: Session = Depends(database.get_db), current_user: auth.Principal = Depends(auth.get_current_user)):
+    access.require(db, current_user.id, event_id, access.CAN_SHARE, "Only owner can share event")
+
+    # One row per group however many members it has
+    roles = {item.group_id: models.RoleEnum(item.role.value) for item in share_data}
+    groups.require_groups(db, roles)
+    rows = [{"group_id": group_id, "event_id": event_id, "role": role} for group_id, role in roles.items()]
+    bulk.upsert(db, models.GroupPermission, rows, ["group_id", "event_id"], ["role"])
+
+    members = groups.member_ids(db, roles)
+    etags.bump_groups(db, roles)
+    feed.notify(db, "permissions.changed", {event_id: {}}, current_user.id)
+    db.commit()
+    access.invalidate_event(event_id)
+    intervals.invalidate_users(members)
+    return rows
+
+@router.get("/{event_id}/groups", response_model=List[schemas.GroupPermissionOut])
+@database.sync_handler
+def list_group_permissions(event_id: int, db: Session = Depends(auth.get_read_db), current_user: auth.Principal = Depends(auth.get_current_user)):
+    access.require(db, current_user.id, event_id, access.CAN_VIEW, "Permission denied")
+    return db.query(models.GroupPermission).filter_by(event_id=event_id).order_by(models.GroupPermission.group_id).all()
+
+@router.delete("/{event_id}/groups/{group_id}", status_code=204)
+@database.sync_handler
+def remove_group_permission(event_id: int, group_id: int, db: Session = Depends(database.get_db), current_user: auth.Principal = Depends(auth.get_current_user)):
+    access.require(db, current_user.id, event_id, access.CAN_SHARE, "Only owner can remove permissions")
+
+    perm = db.query(models.GroupPermission).filter_by(group_id=group_id, event_id=event_id).first()
+    if not perm:
+        raise HTTPException(status_code=404, detail="Permission not found")
 
+    members = groups.member_ids(db, [group_id])
+    # Notified before the delete so the group's members hear that they lost access
+    feed.notify(db, "permissions.changed", {event_id: {}}, current_user.id)
+    db.delete(perm)
+    etags.bump_groups(db, [group_id])
     db.commit()
-    return result
+    access.invalidate_event(event_id)
+    intervals.invalidate_users(members)
 
 # ------------- List Permissions for Event -------------
 @router.get("/{event_id}/permissions", response_model=List[schemas.PermissionOut])
-def list_permissions(event_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
+@database.sync_handler
+def list_permissions(event_id: int, fields: Optional[str] = Query(None, description="Comma-separated subset of permission fields to return"), db: Session = Depends(auth.get_read_db), current_user: auth.Principal = Depends(auth.get_current_user)):
     # Check if user has access
-    perm = db.query(models.Permission).filter_by(user_id=current_user.id, event_id=event_id).first()
-    if not perm:
-        raise HTTPException(status_code=403, detail="Permission denied")
+    access.require(db, current_user.id, event_id, access.CAN_VIEW, "Permission denied")
 
-    return db.query(models.Permission).filter_by(event_id=event_id).all()
+    selected = serialization.parse_fields(fields, PERMISSION_FIELDS)
+    rows = db.query(*(models.Permission.__table__.c[name] for name in selected)).filter_by(event_id=event_id).all()
+    return serialization.FastJSONResponse(serialization.project(rows, selected))
 
 # ------------- Update User Role -------------
 @router.put("/{event_id}/permissions/{user_id}", response_model=schemas.PermissionOut)
-def update_permission(event_id: int, user_id: int, data: schemas.ShareUser, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
+@database.sync_handler
+def update_permission(event_id: int, user_id: int, data: schemas.ShareUser, db: Session = Depends(database.get_db), current_user: auth.Principal = Depends(auth.get_current_user)):
     # Only owner can update
-    owner_perm = db.query(models.Permission).filter_by(user_id=current_user.id, event_id=event_id, role="Owner").first()
-    if not owner_perm:
-        raise HTTPException(status_code=403, detail="Only owner can update permissions")
+    access.require(db, current_user.id, event_id, access.CAN_SHARE, "Only owner can update permissions")
 
     perm = db.query(models.Permission).filter_by(user_id=user_id, event_id=event_id).first()
     if not perm:
         raise HTTPException(status_code=404, detail="Permission not found")
 
     perm.role = data.role
+    etags.bump_users(db, [user_id])
+    feed.notify(db, "permissions.changed", {event_id: {}}, current_user.id)
     db.commit()
+    access.invalidate(user_id, event_id)
     return perm
 
 # ------------- Remove User Access -------------
 @router.delete("/{event_id}/permissions/{user_id}", status_code=204)
-def remove_permission(event_id: int, user_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
+@database.sync_handler
+def remove_permission(event_id: int, user_id: int, db: Session = Depends(database.get_db), current_user: auth.Principal = Depends(auth.get_current_user)):
     # Only owner can revoke access
-    owner_perm = db.query(models.Permission).filter_by(user_id=current_user.id, event_id=event_id, role="Owner").first()
-    if not owner_perm:
-        raise HTTPException(status_code=403, detail="Only owner can remove permissions")
+    access.require(db, current_user.id, event_id, access.CAN_SHARE, "Only owner can remove permissions")
 
     perm = db.query(models.Permission).filter_by(user_id=user_id, event_id=event_id).first()
     if not perm:
         raise HTTPException(status_code=404, detail="Permission not found")
 
+    feed.notify(db, "permissions.changed", {event_id: {}}, current_user.id)
     db.delete(perm)
+    etags.bump_users(db, [user_id])
     db.commit()
+    access.invalidate(user_id, event_id)
+    intervals.invalidate_user(user_id)
@@ -0,0 +1,246 @@
+"""Recurrence rules and the materialized occurrence index.
+
+Supports an RRULE subset: FREQ (DAILY/WEEKLY/MONTHLY/YEARLY), INTERVAL, COUNT, UNTIL, BYDAY
+(weekly) and BYMONTHDAY (monthly), with or without the "RRULE:" prefix. A bare frequency such as
+"weekly" is accepted too.
+
+Occurrences are written to event_occurrences whenever an event's schedule changes, from
+OCCURRENCE_LOOKBACK_DAYS back to OCCURRENCE_HORIZON_DAYS ahead. Run `python -m app.recurrence` to build the index for existing
+events and, periodically (e.g. daily), to move the horizon forward.
+"""
+import argparse
+import calendar
+import os
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Iterator, Optional, Tuple
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from . import models
+
+OCCURRENCE_HORIZON_DAYS = int(os.getenv("OCCURRENCE_HORIZON_DAYS", 365))
+OCCURRENCE_LOOKBACK_DAYS = int(os.getenv("OCCURRENCE_LOOKBACK_DAYS", 365))
+# Counted within the indexed window only, so a long-running series is not cut off at its 1000th date
+OCCURRENCE_MAX_PER_EVENT = int(os.getenv("OCCURRENCE_MAX_PER_EVENT", 1000))
+# Give up on rules that stop producing dates (e.g. BYMONTHDAY=31 with INTERVAL=12 from February)
+MAX_EMPTY_PERIODS = 1000
+
+FREQUENCIES = ("DAILY", "WEEKLY", "MONTHLY", "YEARLY")
+WEEKDAYS = {"MO": 0, "TU": 1, "WE": 2, "TH": 3, "FR": 4, "SA": 5, "SU": 6}
+
+@dataclass(frozen=True)
+class Rule:
+    freq: str
+    interval: int = 1
+    count: Optional[int] = None
+    until: Optional[datetime] = None
+    byday: Tuple[int, ...] = ()
+    bymonthday: Tuple[int, ...] = ()
+
+# ---------- Parsing ----------
+def _parse_until(value: str) -> datetime:
+    for fmt in ("%Y%m%dT%H%M%SZ", "%Y%m%dT%H%M%S", "%Y%m%d"):
+        try:
+            until = datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        # Event times are stored as naive datetimes; a date-only UNTIL includes the whole day
+        return until + timedelta(days=1) - timedelta(microseconds=1) if fmt == "%Y%m%d" else until
+    raise ValueError(f"Invalid UNTIL value: {value}")
+
+def parse_rule(pattern: str) -> Rule:
+    text = pattern.strip()
+    if text.upper().startswith("RRULE:"):
+        text = text[len("RRULE:"):]
+    if text.upper() in FREQUENCIES:
+        return Rule(freq=text.upper())
+
+    parts = {}
+    for part in filter(None, text.split(";")):
+        key, sep, value = part.partition("=")
+        if not sep:
+            raise ValueError(f"Invalid rule part: {part}")
+        parts[key.strip().upper()] = value.strip().upper()
+
+    freq = parts.pop("FREQ", None)
+    if freq not in FREQUENCIES:
+        raise ValueError("FREQ must be one of " + ", ".join(FREQUENCIES))
+    interval, count, until = parts.pop("INTERVAL", "1"), parts.pop("COUNT", None), parts.pop("UNTIL", None)
+    byday, bymonthday = parts.pop("BYDAY", None), parts.pop("BYMONTHDAY", None)
+    if parts:
+        raise ValueError("Unsupported rule parts: " + ", ".join(sorted(parts)))
+    try:
+        rule = Rule(
+            freq=freq,
+            interval=int(interval),
+            count=int(count) if count is not None else None,
+            until=_parse_until(until) if until is not None else None,
+            byday=tuple(sorted(WEEKDAYS[day] for day in byday.split(","))) if byday else (),
+            bymonthday=tuple(sorted(int(day) for day in bymonthday.split(","))) if bymonthday else (),
+        )
+    except KeyError as exc:
+        raise ValueError(f"Unknown weekday: {exc.args[0]}")
+    if rule.interval < 1 or (rule.count is not None and rule.count < 1):
+        raise ValueError("INTERVAL and COUNT must be positive")
+    if any(not 1 <= day <= 31 for day in rule.bymonthday):
+        raise ValueError("BYMONTHDAY must be between 1 and 31")
+    return rule
+
+# ---------- Expansion ----------
+def _periods_before(rule: Rule, dtstart: datetime, moment: datetime) -> int:
+    # Whole periods between dtstart and moment, rounded down and less one, so no date at or after moment is skipped
+    if moment <= dtstart:
+        return 0
+    if rule.freq == "DAILY":
+        periods = (moment - dtstart).days // rule.interval
+    elif rule.freq == "WEEKLY":
+        periods = (moment - dtstart).days // (7 * rule.interval)
+    elif rule.freq == "MONTHLY":
+        periods = ((moment.year - dtstart.year) * 12 + moment.month - dtstart.month) // rule.interval
+    else:
+        periods = (moment.year - dtstart.year) // rule.interval
+    return max(0, periods - 1)
+
+def _period_starts(rule: Rule, dtstart: datetime, period: int = 0) -> Iterator[list]:
+    # Candidate start times, one list per period (day / week / month / year), from the given period on
+    while True:
+        step = period * rule.interval
+        if rule.freq == "DAILY":
+            yield [dtstart + timedelta(days=step)]
+        elif rule.freq == "WEEKLY":
+            if rule.byday:
+                week_start = dtstart - timedelta(days=dtstart.weekday()) + timedelta(weeks=step)
+                yield [week_start + timedelta(days=day) for day in rule.byday]
+            else:
+                yield [dtstart + timedelta(weeks=step)]
+        else:
+            months = step if rule.freq == "MONTHLY" else step * 12
+            year, month = divmod(dtstart.month - 1 + months, 12)
+            year, month = dtstart.year + year, month + 1
+            days = rule.bymonthday if rule.freq == "MONTHLY" and rule.bymonthday else (dtstart.day,)
+            last_day = calendar.monthrange(year, month)[1]
+            # Dates that do not exist in this month (Feb 30, Feb 29 off leap years) are skipped
+            yield [dtstart.replace(year=year, month=month, day=day) for day in days if day <= last_day]
+        period += 1
+
+def check_pattern(pattern: Optional[str], is_recurring: bool):
+    # Raises ValueError for a pattern the engine cannot expand; input models and updates that change the pattern call it
+    if pattern and is_recurring:
+        try:
+            parse_rule(pattern)
+        except ValueError as exc:
+            raise ValueError(f"Invalid recurrence_pattern: {exc}")
+
+def schedule_changed(event, values: dict) -> bool:
+    return any(field in values and values[field] != getattr(event, field) for field in ("is_recurring", "recurrence_pattern"))
+
+def iter_occurrences(rule: Rule, dtstart: datetime, after: Optional[datetime] = None) -> Iterator[datetime]:
+    # Starts at the period holding `after` when it can: COUNT rules are walked from dtstart, since
+    # skipped dates still count towards COUNT
+    first = _periods_before(rule, dtstart, after) if after is not None and rule.count is None else 0
+    produced = 0
+    empty = 0
+    for candidates in _period_starts(rule, dtstart, first):
+        candidates = [start for start in candidates if start >= dtstart]
+        empty = 0 if candidates else empty + 1
+        if empty > MAX_EMPTY_PERIODS:
+            return
+        for start in candidates:
+            if rule.until is not None and start > rule.until:
+                return
+            yield start
+            produced += 1
+            if rule.count is not None and produced >= rule.count:
+                return
+
+def expand(start_time: datetime, end_time: datetime, pattern: Optional[str], is_recurring: bool, until: datetime, limit: int, since: Optional[datetime] = None) -> Iterator[Tuple[datetime, datetime]]:
+    # Lazily yields up to `limit` (start, end) pairs overlapping [since, until); a one-off event yields itself
+    duration = end_time - start_time
+    if not is_recurring or not pattern:
+        yield start_time, end_time
+        return
+    produced = 0
+    for start in iter_occurrences(parse_rule(pattern), start_time, since - duration if since is not None else None):
+        if produced >= limit or start >= until:
+            return
+        if since is not None and start + duration <= since:
+            continue
+        yield start, start + duration
+        produced += 1
+
+# ---------- Occurrence index ----------
+SCHEDULE_FIELDS = ("start_time", "end_time", "is_recurring", "recurrence_pattern")
+
+def schedule_key(event) -> tuple:
+    return tuple(getattr(event, field) for field in SCHEDULE_FIELDS)
+
+def horizon() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(days=OCCURRENCE_HORIZON_DAYS)
+
+def lookback() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=OCCURRENCE_LOOKBACK_DAYS)
+
+def occurrence_rows(event, until: Optional[datetime] = None, since: Optional[datetime] = None) -> list:
+    # Series that start in the future still get a full horizon of occurrences; older dates of a
+    # long-running series are left out rather than crowding the window out of the per-event cap
+    until = max(until or horizon(), event.start_time + timedelta(days=OCCURRENCE_HORIZON_DAYS))
+    try:
+        occurrences = list(expand(
+            event.start_time, event.end_time, event.recurrence_pattern, event.is_recurring,
+            until, OCCURRENCE_MAX_PER_EVENT, since or lookback(),
+        ))
+    except ValueError:
+        # Patterns stored before rules were validated fall back to the single occurrence
+        occurrences = [(event.start_time, event.end_time)]
+    return [{"event_id": event.id, "start_time": start, "end_time": end} for start, end in occurrences]
+
+def index_events(db: Session, events):
+    until, since = horizon(), lookback()
+    rows = [row for event in events for row in occurrence_rows(event, until, since)]
+    if rows:
+        db.execute(insert(models.EventOccurrence), rows)
+
+def clear_event(db: Session, event_id: int):
+    clear_events(db, [event_id])
+
+def clear_events(db: Session, event_ids):
+    db.query(models.EventOccurrence).filter(models.EventOccurrence.event_id.in_(event_ids)).delete(synchronize_session=False)
+
+def reindex_event(db: Session, event, previous_key: Optional[tuple] = None) -> bool:
+    # Only touches the index when the schedule actually changed; returns whether it did
+    if previous_key is not None and previous_key == schedule_key(event):
+        return False
+    clear_event(db, event.id)
+    index_events(db, [event])
+    return True
+
+def main():
+    from . import database
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunk-size", type=int, default=500)
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=database.engine)
+    db = database.SessionLocal()
+    indexed = 0
+    try:
+        last_id = 0
+        while True:
+            events = db.query(models.Event).filter(models.Event.id > last_id).order_by(models.Event.id).limit(args.chunk_size).all()
+            if not events:
+                break
+            for event in events:
+                clear_event(db, event.id)
+            index_events(db, events)
+            db.commit()
+            indexed += len(events)
+            last_id = events[-1].id
+    finally:
+        db.close()
+    print(f"indexed {indexed} events up to {horizon():%Y-%m-%d}")
+
+if __name__ == "__main__":
+    main()
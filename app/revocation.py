@@ -0,0 +1,105 @@
+import hashlib
+import math
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import models
+
+REVOCATION_SYNC_SECONDS = float(os.getenv("REVOCATION_SYNC_SECONDS", 2))
+REVOCATION_PRUNE_SECONDS = float(os.getenv("REVOCATION_PRUNE_SECONDS", 300))
+REVOCATION_BLOOM_CAPACITY = int(os.getenv("REVOCATION_BLOOM_CAPACITY", 100000))
+REVOCATION_BLOOM_ERROR_RATE = float(os.getenv("REVOCATION_BLOOM_ERROR_RATE", 0.001))
+# Re-read rows revoked slightly before the last sync to tolerate clock skew between workers
+SYNC_OVERLAP = timedelta(seconds=60)
+
+# ---------- Bloom filter ----------
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float):
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], "big"), int.from_bytes(digest[8:], "big") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item: str):
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+# ---------- Store ----------
+def token_id(claims: dict, token: str) -> str:
+    # Tokens issued before jti was added are identified by their hash
+    return claims.get("jti") or hashlib.sha256(token.encode()).hexdigest()
+
+# Revoked token ids live in the revoked_tokens table, shared by every worker. Each worker
+# keeps a Bloom filter of them, refreshed from the table at most every REVOCATION_SYNC_SECONDS,
+# so the common "not revoked" answer needs no query. Rows are pruned once the token expires.
+class RevocationStore:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._bloom = BloomFilter(REVOCATION_BLOOM_CAPACITY, REVOCATION_BLOOM_ERROR_RATE)
+        self._watermark = None
+        self._next_sync = 0.0
+        self._next_prune = 0.0
+
+    def revoke(self, db: Session, jti: str, expires_at: datetime) -> bool:
+        db.add(models.RevokedToken(jti=jti, expires_at=expires_at, revoked_at=datetime.utcnow()))
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            return False
+        with self._lock:
+            self._bloom.add(jti)
+        return True
+
+    def is_revoked(self, db: Session, jti: str) -> bool:
+        self.sync(db)
+        if jti not in self._bloom:
+            return False
+        return db.query(models.RevokedToken.jti).filter(
+            models.RevokedToken.jti == jti, models.RevokedToken.expires_at > datetime.utcnow()
+        ).first() is not None
+
+    def sync(self, db: Session):
+        now = time.monotonic()
+        if now < self._next_sync:
+            return
+        with self._lock:
+            if now < self._next_sync:
+                return
+            self._next_sync = now + REVOCATION_SYNC_SECONDS
+            if now >= self._next_prune:
+                self._next_prune = now + REVOCATION_PRUNE_SECONDS
+                self._prune(db)
+                return
+            query = db.query(models.RevokedToken.jti, models.RevokedToken.revoked_at)
+            if self._watermark is not None:
+                query = query.filter(models.RevokedToken.revoked_at > self._watermark - SYNC_OVERLAP)
+            for jti, revoked_at in query:
+                self._bloom.add(jti)
+                if self._watermark is None or revoked_at > self._watermark:
+                    self._watermark = revoked_at
+
+    def _prune(self, db: Session):
+        # Bloom filters cannot forget, so drop expired rows and rebuild from what is left
+        db.query(models.RevokedToken).filter(models.RevokedToken.expires_at <= datetime.utcnow()).delete(synchronize_session=False)
+        db.commit()
+        rows = db.query(models.RevokedToken.jti, models.RevokedToken.revoked_at).all()
+        bloom = BloomFilter(max(REVOCATION_BLOOM_CAPACITY, 2 * len(rows)), REVOCATION_BLOOM_ERROR_RATE)
+        for jti, _ in rows:
+            bloom.add(jti)
+        self._bloom = bloom
+        self._watermark = max((revoked_at for _, revoked_at in rows), default=self._watermark)
+
+store = RevocationStore()
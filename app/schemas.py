@@ -1,8 +1,10 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, validator
 from typing import Optional, List
 from datetime import datetime
 from enum import Enum
 
+from . import intervals, recurrence
+
 class RoleEnum(str, Enum):
     owner = "Owner"
     editor = "Editor"
@@ -22,6 +24,18 @@ class UserOut(UserBase):
     class Config:
         orm_mode = True
 
+class UserBatchResult(BaseModel):
+    index: int
+    # created | conflict | invalid
+    status: str
+    id: Optional[int] = None
+    username: Optional[str] = None
+    detail: Optional[str] = None
+    errors: Optional[List[dict]] = None
+
+class UserBatchOut(BaseModel):
+    results: List[UserBatchResult]
+
 # ---------- Auth Schemas ----------
 
 class Token(BaseModel):
@@ -46,19 +60,72 @@ class EventBase(BaseModel):
     is_recurring: bool = False
     recurrence_pattern: Optional[str] = None
 
+def naive_times(cls, value):
+    # Stored times are naive UTC
+    return intervals.naive_utc(value) if value is not None else value
+
 class EventCreate(EventBase):
-    pass
+    _naive_times = validator("start_time", "end_time", allow_reuse=True)(naive_times)
+
+    @validator("recurrence_pattern")
+    def check_recurrence_pattern(cls, value, values):
+        recurrence.check_pattern(value, values.get("is_recurring"))
+        return value
 
 class EventUpdate(EventBase):
-    pass
+    # The pattern is checked by the handler and only when it changes, so an event stored with a
+    # pattern from before validation can still be saved unchanged
+    _naive_times = validator("start_time", "end_time", allow_reuse=True)(naive_times)
 
 class EventOut(EventBase):
     id: int
     created_at: datetime
     creator_id: int
+    version: int
     class Config:
         orm_mode = True
 
+class BatchItemError(BaseModel):
+    index: int
+    errors: List[dict]
+
+class BatchCreateOut(BaseModel):
+    created: List[EventOut]
+    errors: List[BatchItemError] = []
+
+class EventPatch(BaseModel):
+    # Batch PATCH item: only the fields that are set are changed
+    id: int
+    # Optional precondition, like If-Match on PUT
+    version: Optional[int] = None
+    title: Optional[str] = None
+    description: Optional[str] = None
+    start_time: Optional[datetime] = None
+    end_time: Optional[datetime] = None
+    location: Optional[str] = None
+    is_recurring: Optional[bool] = None
+    recurrence_pattern: Optional[str] = None
+
+    _naive_times = validator("start_time", "end_time", allow_reuse=True)(naive_times)
+
+class BatchItemResult(BaseModel):
+    id: int
+    # updated | deleted | not_found | forbidden | conflict | invalid
+    status: str
+    detail: Optional[str] = None
+    errors: Optional[List[dict]] = None
+    version: Optional[int] = None
+
+class BatchWriteOut(BaseModel):
+    results: List[BatchItemResult]
+
+class OccurrenceOut(BaseModel):
+    event_id: int
+    title: str
+    start_time: datetime
+    end_time: datetime
+    location: Optional[str] = None
+
 # ---------- Permissions ----------
 
 class ShareUser(BaseModel):
@@ -72,6 +139,31 @@ class PermissionOut(BaseModel):
     class Config:
         orm_mode = True
 
+class ShareGroup(BaseModel):
+    group_id: int
+    role: RoleEnum
+
+class GroupPermissionOut(BaseModel):
+    group_id: int
+    event_id: int
+    role: RoleEnum
+    class Config:
+        orm_mode = True
+
+# ---------- Groups ----------
+
+class GroupCreate(BaseModel):
+    name: str
+    member_ids: List[int] = []
+
+class GroupOut(BaseModel):
+    id: int
+    name: str
+    owner_id: int
+    created_at: Optional[datetime] = None
+    class Config:
+        orm_mode = True
+
 # ---------- History and Versioning ----------
 
 class EventHistoryOut(BaseModel):
@@ -93,3 +185,43 @@ class DiffResponse(BaseModel):
     field: str
     old_value: Optional[str]
     new_value: Optional[str]
+    # Unified line diff, only for long text fields (description)
+    text_diff: Optional[List[str]] = None
+
+class VersionDiff(BaseModel):
+    from_version: int
+    to_version: int
+    changes: List[DiffResponse]
+
+# ---------- Availability ----------
+
+class TimeSlot(BaseModel):
+    start_time: datetime
+    end_time: datetime
+
+class ConflictCheck(TimeSlot):
+    # Skips the event being edited when checking an update
+    exclude_event_id: Optional[int] = None
+
+    @validator("end_time")
+    def check_end_time(cls, value, values):
+        if "start_time" in values and value <= values["start_time"]:
+            raise ValueError("end_time must be after start_time")
+        return value
+
+class Conflict(BaseModel):
+    event_id: int
+    start_time: datetime
+    end_time: datetime
+
+class ConflictResult(BaseModel):
+    start_time: datetime
+    end_time: datetime
+    conflict: bool
+    conflicts: List[Conflict]
+
+class FreeBusyOut(BaseModel):
+    start_time: datetime
+    end_time: datetime
+    busy: List[TimeSlot]
+    free: List[TimeSlot]
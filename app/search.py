@@ -0,0 +1,79 @@
+import os
+import re
+
+from sqlalchemy import column, event, false, func, literal, literal_column, table, text
+
+from . import models
+
+# Text search configuration for PostgreSQL (to_tsvector / websearch_to_tsquery)
+SEARCH_LANGUAGE = os.getenv("SEARCH_LANGUAGE", "english")
+# Relative weight of title, description and location matches
+SEARCH_WEIGHTS = (10.0, 4.0, 2.0)
+
+# ---------- Index maintenance ----------
+# The index is kept by the database itself (a generated column on PostgreSQL, triggers on SQLite), so
+# every write path stays covered: ORM writes, multi-row inserts, COPY, set-based deletes and rollbacks.
+POSTGRES_DDL = [
+    f"""ALTER TABLE events ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('{SEARCH_LANGUAGE}', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('{SEARCH_LANGUAGE}', coalesce(description, '')), 'B') ||
+        setweight(to_tsvector('{SEARCH_LANGUAGE}', coalesce(location, '')), 'C')
+    ) STORED""",
+    "CREATE INDEX IF NOT EXISTS ix_events_search_vector ON events USING GIN (search_vector)",
+]
+
+SQLITE_DDL = [
+    """CREATE VIRTUAL TABLE events_fts USING fts5(
+        title, description, location, content='events', content_rowid='id', tokenize='porter unicode61'
+    )""",
+    """CREATE TRIGGER events_fts_insert AFTER INSERT ON events BEGIN
+        INSERT INTO events_fts(rowid, title, description, location) VALUES (new.id, new.title, new.description, new.location);
+    END""",
+    """CREATE TRIGGER events_fts_delete AFTER DELETE ON events BEGIN
+        INSERT INTO events_fts(events_fts, rowid, title, description, location) VALUES ('delete', old.id, old.title, old.description, old.location);
+    END""",
+    """CREATE TRIGGER events_fts_update AFTER UPDATE OF title, description, location ON events BEGIN
+        INSERT INTO events_fts(events_fts, rowid, title, description, location) VALUES ('delete', old.id, old.title, old.description, old.location);
+        INSERT INTO events_fts(rowid, title, description, location) VALUES (new.id, new.title, new.description, new.location);
+    END""",
+    # Indexes rows that existed before the table was added
+    "INSERT INTO events_fts(events_fts) VALUES ('rebuild')",
+]
+
+@event.listens_for(models.Base.metadata, "after_create")
+def install(target, connection, **kw):
+    # Runs after every create_all, so existing databases pick the index up on the next start
+    dialect = connection.dialect.name
+    if dialect == "postgresql":
+        for statement in POSTGRES_DDL:
+            connection.execute(text(statement))
+    elif dialect == "sqlite":
+        exists = connection.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'events_fts'")).first()
+        if not exists:
+            for statement in SQLITE_DDL:
+                connection.execute(text(statement))
+
+# ---------- Querying ----------
+def fts5_query(q: str) -> str:
+    # Every word quoted, so FTS5 operators and punctuation in user input are matched literally
+    return " ".join('"' + word + '"' for word in re.findall(r"\w+", q))
+
+def match(query, q: str, dialect: str):
+    # Restricts an events query to rows matching q; returns it with a relevance score (higher is better)
+    if dialect == "postgresql":
+        vector = literal_column("events.search_vector")
+        tsquery = func.websearch_to_tsquery(SEARCH_LANGUAGE, q)
+        return query.filter(vector.op("@@")(tsquery)), func.ts_rank(vector, tsquery)
+    if dialect == "sqlite":
+        terms = fts5_query(q)
+        if not terms:
+            return query.filter(false()), literal(0)
+        fts = table("events_fts", column("rowid"))
+        index = literal_column("events_fts")
+        query = query.join(fts, fts.c.rowid == models.Event.id).filter(index.op("MATCH")(terms))
+        # bm25() is lower for better matches
+        return query, -func.bm25(index, *SEARCH_WEIGHTS)
+    # No index on other backends: unranked substring match
+    pattern = f"%{q}%"
+    Event = models.Event
+    return query.filter(Event.title.ilike(pattern) | Event.description.ilike(pattern) | Event.location.ilike(pattern)), literal(0)
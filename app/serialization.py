@@ -0,0 +1,47 @@
+import json
+from datetime import datetime
+from enum import Enum
+from typing import Iterable, List, Optional, Sequence
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # falls back to the stdlib encoder
+    orjson = None
+
+# ---------- Encoding ----------
+def _default(value):
+    if isinstance(value, datetime):
+        # Same form Pydantic emits: UTC as "Z", naive datetimes without an offset
+        text = value.isoformat()
+        return text[:-6] + "Z" if text.endswith("+00:00") else text
+    if isinstance(value, Enum):
+        return value.value
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_UTC_Z)
+    return json.dumps(content, default=_default, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+class FastJSONResponse(JSONResponse):
+    # Renders plain dicts/lists directly, skipping response_model validation
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+# ---------- Sparse fieldsets ----------
+def parse_fields(fields: Optional[str], allowed: Sequence[str]) -> List[str]:
+    # "?fields=id,title" -> ["id", "title"] in schema order; all fields when omitted
+    if not fields:
+        return list(allowed)
+    requested = {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = requested.difference(allowed)
+    if unknown:
+        raise HTTPException(status_code=400, detail="Unknown fields: " + ", ".join(sorted(unknown)))
+    return [name for name in allowed if name in requested]
+
+def project(rows: Iterable, fields: Sequence[str]) -> List[dict]:
+    # Column-projected Row tuples -> dicts holding only the requested fields
+    return [{name: getattr(row, name) for name in fields} for row in rows]
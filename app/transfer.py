@@ -0,0 +1,121 @@
+import codecs
+import json
+import os
+from datetime import datetime, timezone
+from typing import AsyncIterator, List
+
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from . import models, schemas, database, access, bulk, etags, ical, intervals, serialization
+
+EXPORT_YIELD_PER = int(os.getenv("EXPORT_YIELD_PER", 1000))
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", 1000))
+# Per-item error details kept in the import summary; the count is always complete
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", 100))
+
+FORMATS = {"ics": "text/calendar", "ndjson": "application/x-ndjson"}
+EXPORT_FIELDS = list(schemas.EventOut.__fields__)
+
+# ---------- Export ----------
+def export_statement(user_id: int):
+    Event = models.Event
+    return (
+        select(*(Event.__table__.c[name] for name in EXPORT_FIELDS))
+        .where(Event.id.in_(access.visible_event_ids(user_id)))
+        .order_by(Event.start_time, Event.id)
+    )
+
+async def export_events(user_id: int, fmt: str) -> AsyncIterator[bytes]:
+    # Rows come through a server-side cursor and leave in buffers of EXPORT_YIELD_PER events
+    stamp = datetime.now(timezone.utc)
+    if fmt == "ics":
+        yield ical.calendar_header().encode()
+    buffer: List[bytes] = []
+    async for row in database.stream_rows(export_statement(user_id), EXPORT_YIELD_PER):
+        if fmt == "ics":
+            buffer.append(ical.format_event(row, stamp).encode())
+        else:
+            buffer.append(serialization.dumps({name: getattr(row, name) for name in EXPORT_FIELDS}) + b"\n")
+        if len(buffer) >= EXPORT_YIELD_PER:
+            yield b"".join(buffer)
+            buffer = []
+    if buffer:
+        yield b"".join(buffer)
+    if fmt == "ics":
+        yield ical.calendar_footer().encode()
+
+# ---------- Import ----------
+class ProgressResponse(StreamingResponse):
+    # Progress is written while the upload is still being read. StreamingResponse would also start a
+    # disconnect listener on receive(), which swallows the remaining body messages, so stream without it.
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    # Decodes the upload as it arrives; a multi-byte character may straddle two chunks
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    tail = ""
+    async for chunk in chunks:
+        lines = (tail + decoder.decode(chunk)).split("\n")
+        tail = lines.pop()
+        for line in lines:
+            yield line.rstrip("\r")
+    tail += decoder.decode(b"", final=True)
+    if tail:
+        yield tail.rstrip("\r")
+
+async def iter_ndjson(lines: AsyncIterator[str]) -> AsyncIterator[object]:
+    async for line in lines:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as exc:
+            yield ValueError(f"Invalid JSON: {exc}")
+
+def _write_chunk(db: Session, user_id: int, events: List[schemas.EventCreate]) -> List[int]:
+    db.info["user_id"] = user_id
+    created = bulk.create_events(db, user_id, events)
+    etags.bump_users(db, [user_id])
+    db.commit()
+    return [event.id for event in created]
+
+async def import_events(user_id: int, fmt: str, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    # Streams NDJSON progress: a line per committed chunk, then a summary with the item errors
+    lines = iter_lines(chunks)
+    items = ical.iter_events(lines) if fmt == "ics" else iter_ndjson(lines)
+    processed = imported = failed = 0
+    errors, batch = [], []
+
+    async def flush():
+        nonlocal imported
+        created = await database.run_in_session(_write_chunk, user_id, batch)
+        for event_id in created:
+            access.invalidate(user_id, event_id)
+        intervals.invalidate_user(user_id)
+        imported += len(created)
+        batch.clear()
+
+    async for item in items:
+        index = processed
+        processed += 1
+        try:
+            if isinstance(item, Exception):
+                raise item
+            batch.append(schemas.EventCreate.parse_obj(item))
+        except (ValueError, ValidationError) as exc:
+            failed += 1
+            if len(errors) < IMPORT_MAX_ERRORS:
+                detail = json.loads(exc.json()) if isinstance(exc, ValidationError) else [{"msg": str(exc)}]
+                errors.append({"index": index, "errors": detail})
+        if len(batch) >= IMPORT_CHUNK_SIZE:
+            await flush()
+            yield serialization.dumps({"processed": processed, "imported": imported, "failed": failed}) + b"\n"
+    if batch:
+        await flush()
+    yield serialization.dumps({"done": True, "processed": processed, "imported": imported, "failed": failed, "errors": errors}) + b"\n"
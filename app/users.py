@@ -0,0 +1,99 @@
+import json
+import os
+from typing import Any, Dict, List
+
+from fastapi import APIRouter, Body, Depends, HTTPException
+from pydantic import ValidationError
+from sqlalchemy import or_, select
+from sqlalchemy.orm import Session
+
+from . import models, schemas, database, auth, admission, bulk, hashing
+
+# Usernames allowed to provision accounts, comma-separated; empty (the default) turns the endpoint off.
+# Each call creates up to BATCH_MAX_ITEMS users and hashes that many passwords, far past what the
+# per-IP limit on /register allows, so it is not open to every signed-in user.
+PROVISIONING_ADMINS = {name.strip() for name in os.getenv("PROVISIONING_ADMINS", "").split(",") if name.strip()}
+
+router = APIRouter(prefix="/api/users", tags=["Users"])
+
+def require_provisioner(current_user: auth.Principal = Depends(auth.get_current_user)) -> auth.Principal:
+    if current_user.username not in PROVISIONING_ADMINS:
+        raise HTTPException(status_code=403, detail="Not allowed to provision users")
+    return current_user
+
+# Checked after the allow-list, so other users' calls never reach or drain the bucket
+provision_limit = admission.limit("provision", admission.RATE_LIMIT_BULK, admission.BULK_CONCURRENCY, principal=require_provisioner)
+
+# ---------- Helpers ----------
+def _validate(items: List[Dict[str, Any]]):
+    # Returns per-item results in payload order and (index, UserCreate) for the items worth inserting
+    results, candidates = [], []
+    usernames, emails = {}, {}
+    for index, raw in enumerate(items):
+        result = {"index": index}
+        results.append(result)
+        try:
+            user = schemas.UserCreate.parse_obj(raw)
+        except ValidationError as exc:
+            result.update(status="invalid", errors=json.loads(exc.json()))
+            continue
+        result["username"] = user.username
+        if len(user.username) > models.User.username.type.length or len(user.email) > models.User.email.type.length:
+            result.update(status="invalid", detail="Username or email too long")
+        elif user.username in usernames:
+            result.update(status="conflict", detail=f"Duplicate username in batch (item {usernames[user.username]})")
+        elif user.email in emails:
+            result.update(status="conflict", detail=f"Duplicate email in batch (item {emails[user.email]})")
+        else:
+            usernames[user.username] = emails[user.email] = index
+            candidates.append((index, user))
+    return results, candidates
+
+def _taken(db: Session, usernames: List[str], emails: List[str]):
+    # One query for the whole batch instead of two per user
+    rows = db.execute(
+        select(models.User.username, models.User.email)
+        .where(or_(models.User.username.in_(usernames), models.User.email.in_(emails)))
+    ).all()
+    # Ends the read transaction so no connection is held while the passwords are hashed
+    db.rollback()
+    return {username for username, _ in rows}, {email for _, email in rows}
+
+def _insert_users(db: Session, rows: List[dict]) -> Dict[str, int]:
+    # A transaction per chunk; the unique constraints reject users created since _taken() ran
+    created = {}
+    for chunk in bulk.chunks(rows, bulk.BATCH_CHUNK_SIZE):
+        created.update(bulk.insert_new(db, models.User, chunk, (models.User.username, models.User.id)))
+        db.commit()
+    return created
+
+# ---------- Bulk Provisioning ----------
+@router.post("/batch", response_model=schemas.UserBatchOut, dependencies=[provision_limit, admission.max_items(admission.BATCH_MAX_ITEMS)])
+async def provision_users(items: List[Dict[str, Any]] = Body(...), db=Depends(database.get_db), current_user: auth.Principal = Depends(require_provisioner)):
+    # Items are register payloads ({"username", "email", "password"}); results come back in payload order
+    results, candidates = _validate(items)
+    if candidates:
+        taken_usernames, taken_emails = await db.run_sync(
+            _taken, [user.username for _, user in candidates], [user.email for _, user in candidates]
+        )
+        fresh = []
+        for index, user in candidates:
+            if user.username in taken_usernames:
+                results[index].update(status="conflict", detail="Username already exists")
+            elif user.email in taken_emails:
+                results[index].update(status="conflict", detail="Email already exists")
+            else:
+                fresh.append((index, user))
+
+        hashes = await hashing.hash_passwords([user.password for _, user in fresh])
+        rows = [
+            {"username": user.username, "email": user.email, "hashed_password": hashed}
+            for (_, user), hashed in zip(fresh, hashes)
+        ]
+        created = await db.run_sync(_insert_users, rows)
+        for index, user in fresh:
+            if user.username in created:
+                results[index].update(status="created", id=created[user.username])
+            else:
+                results[index].update(status="conflict", detail="Username or email already exists")
+    return {"results": results}
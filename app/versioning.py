@@ -0,0 +1,204 @@
+import difflib
+import os
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import and_, case, func, insert, or_, select
+from sqlalchemy.orm import Session
+
+from . import models, database, serialization
+from .cache import TTLCache
+
+HISTORY_FIELDS = ["title", "description", "start_time", "end_time", "location", "recurrence_pattern"]
+DATETIME_FIELDS = {"start_time", "end_time"}
+# Every Nth version of an event is stored as a full snapshot, the rest as field deltas
+HISTORY_SNAPSHOT_INTERVAL = int(os.getenv("HISTORY_SNAPSHOT_INTERVAL", 20))
+HISTORY_STREAM_YIELD_PER = int(os.getenv("HISTORY_STREAM_YIELD_PER", 500))
+DIFF_CACHE_SIZE = int(os.getenv("DIFF_CACHE_SIZE", 5000))
+DIFF_CACHE_TTL = float(os.getenv("DIFF_CACHE_TTL", 3600))
+# Fields that also get a line-level diff
+TEXT_DIFF_FIELDS = {"description"}
+
+# Everything needed to rebuild versions, loaded as plain rows rather than ORM objects
+HISTORY_COLUMNS = (
+    models.EventHistory.id, models.EventHistory.event_id, models.EventHistory.timestamp,
+    models.EventHistory.changed_by, models.EventHistory.changes,
+    *(models.EventHistory.__table__.c[field] for field in HISTORY_FIELDS),
+)
+
+# History rows are reverse deltas: a row holds the values the changed fields had *before* the
+# change it records. A version is rebuilt by starting from the nearest later snapshot (or the live
+# event) and overlaying the deltas newest to oldest. Rows with changes = NULL are full snapshots,
+# which also covers rows written before delta encoding.
+
+def event_state(event) -> dict:
+    return {field: getattr(event, field) for field in HISTORY_FIELDS}
+
+def encode_changes(values: dict) -> dict:
+    return {field: value.isoformat() if isinstance(value, datetime) else value for field, value in values.items()}
+
+def decode_changes(changes: dict) -> dict:
+    return {
+        field: datetime.fromisoformat(value) if field in DATETIME_FIELDS and value is not None else value
+        for field, value in changes.items()
+    }
+
+def apply_row(state: Optional[dict], row) -> dict:
+    if row.changes is None:
+        return {field: getattr(row, field) for field in HISTORY_FIELDS}
+    return {**state, **decode_changes(row.changes)}
+
+def history_values(event, new_values: dict, changed_by: int, seq: int) -> dict:
+    old = event_state(event)
+    # Stamped here rather than by the database so keyset cursors compare at full precision
+    meta = {"event_id": event.id, "seq": seq, "changed_by": changed_by, "timestamp": datetime.now(timezone.utc)}
+    if seq % HISTORY_SNAPSHOT_INTERVAL == 0:
+        return {**meta, **old, "changes": None}
+    changed = {field: old[field] for field in HISTORY_FIELDS if field in new_values and new_values[field] != old[field]}
+    return {**meta, "changes": encode_changes(changed)}
+
+def build_history(event, new_values: dict, changed_by: int, seq: int) -> models.EventHistory:
+    return models.EventHistory(**history_values(event, new_values, changed_by, seq))
+
+def next_seq(db: Session, event_id: int) -> int:
+    return (db.query(func.max(models.EventHistory.seq)).filter(models.EventHistory.event_id == event_id).scalar() or 0) + 1
+
+def record_change(db: Session, event, new_values: dict, changed_by: int) -> models.EventHistory:
+    # Must be called before new_values are applied to the event. Bumping the version here keeps
+    # it in step with the changelog; the flush fails with StaleDataError if another writer got there first.
+    history = build_history(event, new_values, changed_by, next_seq(db, event.id))
+    db.add(history)
+    event.version += 1
+    return history
+
+def record_changes(db: Session, changes: List[Tuple[object, dict]], changed_by: int):
+    # Batch form of record_change: one grouped seq lookup and one multi-row INSERT for all events
+    History = models.EventHistory
+    event_ids = [event.id for event, _ in changes]
+    last_seqs = dict(
+        db.query(History.event_id, func.max(History.seq)).filter(History.event_id.in_(event_ids)).group_by(History.event_id)
+    )
+    # Same keys on every row (deltas leave the field columns NULL) so it is a single executemany
+    rows = [
+        {**dict.fromkeys(HISTORY_FIELDS), **history_values(event, new_values, changed_by, (last_seqs.get(event.id) or 0) + 1)}
+        for event, new_values in changes
+    ]
+    if rows:
+        db.execute(insert(History), rows)
+    for event, _ in changes:
+        event.version += 1
+
+def version_out(row, state: dict) -> dict:
+    return {"id": row.id, "event_id": row.event_id, "timestamp": row.timestamp, "changed_by": row.changed_by, **state}
+
+def head_state(db: Session, event_id: int) -> dict:
+    event = db.query(models.Event).filter_by(id=event_id).first()
+    if not event:
+        raise HTTPException(status_code=404, detail="Event not found")
+    return event_state(event)
+
+def rebuild(db: Session, event_id: int, low_id: int, high_id: Optional[int] = None) -> Dict[int, dict]:
+    # Versions of event_id with id >= low_id (and up to the snapshot covering high_id), keyed by id
+    History = models.EventHistory
+    anchor = None
+    if high_id is not None:
+        anchor = db.query(func.min(History.id)).filter(
+            History.event_id == event_id, History.id >= high_id, History.changes.is_(None)
+        ).scalar()
+
+    query = db.query(*HISTORY_COLUMNS).filter(History.event_id == event_id, History.id >= low_id)
+    if anchor is not None:
+        query = query.filter(History.id <= anchor)
+        state = None
+    else:
+        state = head_state(db, event_id)
+
+    versions = {}
+    for row in query.order_by(History.id.desc()):
+        state = apply_row(state, row)
+        versions[row.id] = version_out(row, state)
+    return versions
+
+# ---------- Point in time ----------
+def as_of_utc(value: datetime) -> datetime:
+    # Stored timestamps are UTC; naive input is taken as UTC too
+    return _as_utc(value).astimezone(timezone.utc)
+
+def states_as_of(db: Session, event_ids, when: datetime) -> List[dict]:
+    # Every listed event that existed at `when`, as it was then (EventOut fields, ordered by id), from one
+    # statement: the live events outer-joined with the history rows written after `when`. Per event, a
+    # window over (event_id, timestamp) finds the first snapshot after `when`; rows past it are not
+    # needed. Walking the rest newest first from the live state (or that snapshot) undoes the later
+    # changes, exactly as rebuild() does for one event. Deleted events have no row left to rebuild.
+    History, Event = models.EventHistory, models.Event
+    later = (
+        select(
+            History.event_id,
+            History.id.label("history_id"),
+            History.changes,
+            *(History.__table__.c[field].label("old_" + field) for field in HISTORY_FIELDS),
+            func.min(case((History.changes.is_(None), History.id))).over(partition_by=History.event_id).label("anchor"),
+            func.count().over(partition_by=History.event_id).label("undone"),
+        )
+        .where(History.event_id.in_(event_ids), History.timestamp > when)
+        .subquery()
+    )
+    statement = (
+        select(Event.__table__, later.c.history_id, later.c.changes, later.c.undone, *(later.c["old_" + field] for field in HISTORY_FIELDS))
+        .outerjoin(later, and_(later.c.event_id == Event.id, or_(later.c.anchor.is_(None), later.c.history_id <= later.c.anchor)))
+        .where(Event.id.in_(event_ids), Event.created_at <= when)
+        .order_by(Event.id, later.c.history_id.desc())
+    )
+
+    states, current = [], None
+    for row in db.execute(statement):
+        if current is None or current["id"] != row.id:
+            current = {name: getattr(row, name) for name in ("id", "creator_id", "created_at", "is_recurring")}
+            current.update(event_state(row), version=row.version - (row.undone or 0))
+            states.append(current)
+        if row.history_id is None:
+            continue
+        if row.changes is None:
+            current.update({field: getattr(row, "old_" + field) for field in HISTORY_FIELDS})
+        else:
+            current.update(decode_changes(row.changes))
+    return states
+
+# ---------- Diffs ----------
+# Versions never change once written, so diffs are memoized by (event_id, v1, v2)
+diff_cache = TTLCache(DIFF_CACHE_SIZE, DIFF_CACHE_TTL)
+
+def diff_states(old: dict, new: dict) -> List[dict]:
+    diff_list = []
+    for field in HISTORY_FIELDS:
+        if old[field] != new[field]:
+            item = {"field": field, "old_value": str(old[field]), "new_value": str(new[field])}
+            if field in TEXT_DIFF_FIELDS:
+                # Hunks only, without the ---/+++ file header
+                item["text_diff"] = list(difflib.unified_diff(
+                    (old[field] or "").splitlines(), (new[field] or "").splitlines(), lineterm=""
+                ))[2:]
+            diff_list.append(item)
+    return diff_list
+
+def _as_utc(value: datetime) -> datetime:
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+async def stream_versions(event_id: int, state: dict, low_id: int = 0, since: Optional[datetime] = None, until: Optional[datetime] = None, fields: Optional[List[str]] = None, sessions=None):
+    # NDJSON, newest first; rows are walked from the live state so memory stays flat. sessions must
+    # read the database the state came from (see database.session_factories)
+    History = models.EventHistory
+    statement = (
+        select(*HISTORY_COLUMNS)
+        .where(History.event_id == event_id, History.id >= low_id)
+        .order_by(History.id.desc())
+    )
+    since = since and _as_utc(since)
+    until = until and _as_utc(until)
+    async for row in database.stream_rows(statement, HISTORY_STREAM_YIELD_PER, sessions):
+        state = apply_row(state, row)
+        timestamp = _as_utc(row.timestamp)
+        if (since is None or timestamp >= since) and (until is None or timestamp < until):
+            version = version_out(row, state)
+            yield serialization.dumps({name: version[name] for name in fields} if fields else version) + b"\n"
@@ -0,0 +1,314 @@
+"""Load and latency benchmark for the API routers, run in-process against the ASGI app.
+
+Usage:
+    python -m benchmarks.bench_api --output results.json
+    python -m benchmarks.bench_api --workloads list_paginate,diff --requests 500 --concurrency 16
+    python -m benchmarks.bench_api --output after.json --compare before.json
+
+Seeds users, events shared with many users and events with long histories, then runs scripted
+workloads through httpx's ASGI transport, so no server or network is involved. Each workload
+reports throughput, p50/p95/p99 latency and SQL statements per request. Results are written as
+JSON so runs can be compared with --compare. Without DATABASE_URL a throwaway SQLite file is
+used; point DATABASE_URL at a local or embedded PostgreSQL to measure that backend instead.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+if not os.getenv("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ.setdefault("SECRET_KEY", "bench-secret")
+# Every request comes from one client, so the admission limits would only measure themselves
+os.environ.setdefault("RATE_LIMIT_AUTH", "")
+os.environ.setdefault("RATE_LIMIT_BULK", "")
+os.environ.setdefault("BULK_CONCURRENCY", "0")
+
+import httpx  # noqa: E402
+from sqlalchemy import event, insert  # noqa: E402
+
+from app import bulk, database, models, pagination, schemas, utils, versioning  # noqa: E402
+from app.main import app  # noqa: E402
+
+PASSWORD = "bench-password"
+
+
+# ---------- SQL statement counter ----------
+class StatementCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args):
+        self.count += 1
+
+    def attach(self):
+        for engine in database.sync_engines():
+            event.listen(engine, "before_cursor_execute", self)
+
+
+# ---------- Seeding ----------
+def seed(db, args):
+    rng = random.Random(args.seed)
+    stamp = time.time_ns()
+    hashed = utils.hash_password(PASSWORD)
+    usernames = [f"bench-{stamp}-{i}" for i in range(args.users)]
+    user_ids = db.scalars(
+        insert(models.User).returning(models.User.id, sort_by_parameter_order=True),
+        [{"username": name, "email": f"{name}@bench.local", "hashed_password": hashed} for name in usernames],
+    ).all()
+    db.commit()
+
+    start = datetime(2026, 1, 5, 9, 0)
+    events_by_owner = {}
+    for owner_id in user_ids[: args.owners]:
+        payload = []
+        for i in range(args.events_per_owner):
+            begins = start + timedelta(hours=rng.randrange(24 * 365))
+            payload.append(schemas.EventCreate(
+                title=f"Event {i}", description="Agenda and notes. " * 20, location=f"Room {i % 7}",
+                start_time=begins, end_time=begins + timedelta(minutes=45),
+            ))
+        events_by_owner[owner_id] = [created.id for created in bulk.create_events(db, owner_id, payload)]
+    db.commit()
+
+    # Every owner's events are shared with a random set of other users
+    shares = []
+    for owner_id, event_ids in events_by_owner.items():
+        others = [user_id for user_id in user_ids if user_id != owner_id]
+        for event_id in event_ids:
+            for user_id in rng.sample(others, min(args.shares, len(others))):
+                shares.append({"user_id": user_id, "event_id": event_id, "role": rng.choice([models.RoleEnum.viewer, models.RoleEnum.editor])})
+    for chunk in bulk.chunks(shares, bulk.BATCH_CHUNK_SIZE):
+        db.execute(insert(models.Permission), chunk)
+    db.commit()
+
+    # A few events per owner get long histories
+    long_history = []
+    for owner_id, event_ids in events_by_owner.items():
+        for event_id in event_ids[: args.history_events]:
+            model = db.get(models.Event, event_id)
+            for version in range(args.history_length):
+                new_values = versioning.event_state(model)
+                new_values["title"] = f"{model.title.split(' #')[0]} #{version}"
+                if version % 5 == 0:
+                    new_values["description"] = (model.description or "") + f"\nEdit {version}"
+                versioning.record_change(db, model, new_values, owner_id)
+                for attr, value in new_values.items():
+                    setattr(model, attr, value)
+            db.commit()
+            long_history.append((owner_id, event_id))
+
+    names = dict(zip(user_ids, usernames))
+    tokens = {user_id: utils.create_access_token({"sub": names[user_id]}) for user_id in user_ids}
+    return {"usernames": usernames, "tokens": tokens, "events_by_owner": events_by_owner, "long_history": long_history}
+
+
+# ---------- Workloads ----------
+# Each workload is an async function (client, data, rng) that issues one logical request
+def headers(data, user_id):
+    return {"Authorization": f"Bearer {data['tokens'][user_id]}"}
+
+
+async def login_storm(client, data, rng):
+    return await client.post("/api/auth/login", data={"username": rng.choice(data["usernames"]), "password": PASSWORD})
+
+
+async def list_paginate(client, data, rng):
+    # Each request fetches the next page of a user's listing, restarting once the cursor runs out
+    user_id = rng.choice(list(data["tokens"]))
+    cursors = data.setdefault("cursors", {})
+    params = {"limit": 50}
+    if cursors.get(user_id):
+        params["cursor"] = cursors[user_id]
+    response = await client.get("/api/events/", params=params, headers=headers(data, user_id))
+    cursors[user_id] = response.headers.get(pagination.NEXT_CURSOR_HEADER)
+    return response
+
+
+async def update_heavy(client, data, rng):
+    owner_id = rng.choice(list(data["events_by_owner"]))
+    event_id = rng.choice(data["events_by_owner"][owner_id])
+    start = datetime(2026, 6, 1, 9, 0) + timedelta(hours=rng.randrange(2000))
+    # Half the clients send UTC offsets, which the API stores as naive UTC; a 500 here shows up in errors
+    if rng.random() < 0.5:
+        start = start.replace(tzinfo=timezone(timedelta(hours=rng.choice((-5, 2)))))
+    body = {"title": f"Updated {rng.random():.6f}", "start_time": start.isoformat(), "end_time": (start + timedelta(hours=1)).isoformat()}
+    return await client.put(f"/api/events/{event_id}", json=body, headers=headers(data, owner_id))
+
+
+async def batch_create(client, data, rng):
+    owner_id = rng.choice(list(data["events_by_owner"]))
+    start = datetime(2027, 1, 1, 9, 0)
+    body = [
+        {"title": f"Batch {i}", "start_time": (start + timedelta(hours=i)).isoformat(), "end_time": (start + timedelta(hours=i, minutes=30)).isoformat()}
+        for i in range(100)
+    ]
+    return await client.post("/api/events/batch", json=body, headers=headers(data, owner_id))
+
+
+async def diff(client, data, rng):
+    owner_id, event_id = rng.choice(data["long_history"])
+    versions = data.setdefault("versions", {})
+    if event_id not in versions:
+        response = await client.get(f"/api/events/{event_id}/changelog", headers=headers(data, owner_id))
+        versions[event_id] = [item["id"] for item in response.json()]
+    v1, v2 = sorted(rng.sample(versions[event_id], 2))
+    return await client.get(f"/api/events/{event_id}/diff/{v1}/{v2}", headers=headers(data, owner_id))
+
+
+async def changelog(client, data, rng):
+    owner_id, event_id = rng.choice(data["long_history"])
+    return await client.get(f"/api/events/{event_id}/changelog", params={"limit": 50}, headers=headers(data, owner_id))
+
+
+async def permissions(client, data, rng):
+    owner_id = rng.choice(list(data["events_by_owner"]))
+    event_id = rng.choice(data["events_by_owner"][owner_id])
+    return await client.get(f"/api/events/{event_id}/permissions", headers=headers(data, owner_id))
+
+
+WORKLOADS = {
+    "login_storm": login_storm,
+    "list_paginate": list_paginate,
+    "update_heavy": update_heavy,
+    "batch_create": batch_create,
+    "diff": diff,
+    "changelog": changelog,
+    "permissions": permissions,
+}
+
+
+# ---------- Runner ----------
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+async def run_workload(client, name, data, args, counter):
+    fn = WORKLOADS[name]
+    rng = random.Random(f"{args.seed}-{name}")
+    # Warm-up requests prime the caches and are not measured
+    for _ in range(args.warmup):
+        await fn(client, data, rng)
+
+    latencies, statuses = [], {}
+    remaining = args.requests
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            started = time.perf_counter()
+            response = await fn(client, data, rng)
+            latencies.append(time.perf_counter() - started)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    statements_before = counter.count
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": sum(count for status, count in statuses.items() if status >= 400),
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "sql_per_request": round((counter.count - statements_before) / max(1, len(latencies)), 2),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_table(results, baseline=None):
+    print(f"{'workload':<15} {'req':>6} {'err':>5} {'rps':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'sql/req':>8}")
+    for name, result in results.items():
+        line = (
+            f"{name:<15} {result['requests']:>6} {result['errors']:>5} {result['throughput_rps']:>9.1f} "
+            f"{result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f} {result['sql_per_request']:>8.2f}"
+        )
+        previous = (baseline or {}).get(name)
+        if previous:
+            line += f"   rps {result['throughput_rps'] / max(previous['throughput_rps'], 1e-9):.2f}x, p95 {result['p95_ms'] - previous['p95_ms']:+.2f} ms"
+        print(line)
+
+
+async def run(args):
+    counter = StatementCounter()
+    async with app.router.lifespan_context(app):
+        db = database.SessionLocal()
+        try:
+            data = seed(db, args)
+        finally:
+            db.close()
+        counter.attach()
+        transport = httpx.ASGITransport(app=app)
+        results = {}
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for name in args.workloads:
+                results[name] = await run_workload(client, name, data, args, counter)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workloads", default=",".join(WORKLOADS), help="comma-separated subset of: " + ", ".join(WORKLOADS))
+    parser.add_argument("--requests", type=int, default=300, help="measured requests per workload")
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--owners", type=int, default=20)
+    parser.add_argument("--events-per-owner", type=int, default=200)
+    parser.add_argument("--shares", type=int, default=25, help="users each event is shared with")
+    parser.add_argument("--history-events", type=int, default=3, help="events per owner with long histories")
+    parser.add_argument("--history-length", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+    args.workloads = [name.strip() for name in args.workloads.split(",") if name.strip()]
+    unknown = [name for name in args.workloads if name not in WORKLOADS]
+    if unknown:
+        parser.error("unknown workloads: " + ", ".join(unknown))
+
+    models.Base.metadata.create_all(bind=database.engine)
+    results = asyncio.run(run(args))
+
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "revision": git_revision(),
+        "backend": f"{database.engine.dialect.name}+{database.engine.dialect.driver}",
+        "db_mode": database.DB_MODE,
+        "python": platform.python_version(),
+        "parameters": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "results": results,
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare) as fh:
+            baseline = json.load(fh)["results"]
+    print(f"backend: {report['backend']} ({report['db_mode']}), revision {report['revision']}, concurrency {args.concurrency}")
+    print_table(results, baseline)
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump(report, fh, indent=2)
+        print(f"wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
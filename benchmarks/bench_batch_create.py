@@ -0,0 +1,94 @@
+"""Compare the legacy per-event commit loop with the bulk ingestion path.
+
+Usage:
+    DATABASE_URL=postgresql://... python -m benchmarks.bench_batch_create --events 5000
+
+The created events are also validated against the endpoint's response model, so a run at or above
+BATCH_COPY_THRESHOLD on PostgreSQL checks the COPY path's response.
+
+Without DATABASE_URL a throwaway SQLite file is used.
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+if not os.getenv("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+
+from app import bulk, database, models, schemas  # noqa: E402
+
+
+def make_payload(count):
+    start = datetime(2024, 1, 1, 9, 0)
+    return [
+        schemas.EventCreate(
+            title=f"Event {i}",
+            description="Imported\tevent\nwith some text " * 4,
+            start_time=start + timedelta(hours=i),
+            end_time=start + timedelta(hours=i, minutes=30),
+            location="Room 1",
+        )
+        for i in range(count)
+    ]
+
+
+def legacy_loop(db, user_id, events):
+    for event in events:
+        new_event = models.Event(**event.dict(), creator_id=user_id)
+        db.add(new_event)
+        db.commit()
+        db.refresh(new_event)
+        db.add(models.Permission(user_id=user_id, event_id=new_event.id, role="Owner"))
+        db.commit()
+
+
+def bulk_path(db, user_id, events, chunk_size):
+    created = bulk.create_events(db, user_id, events, chunk_size)
+    db.commit()
+    return created
+
+
+def check_response(created):
+    # The endpoint's response_model check: the COPY path builds its objects by hand and must fill every field
+    schemas.BatchCreateOut(created=[schemas.EventOut.model_validate(event, from_attributes=True) for event in created])
+
+
+def timed(label, fn, count):
+    started = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<12} {count:>7} events  {elapsed:8.3f}s  {count / elapsed:10.1f} events/s")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--events", type=int, default=2000)
+    parser.add_argument("--chunk-size", type=int, default=bulk.BATCH_CHUNK_SIZE)
+    parser.add_argument("--skip-legacy", action="store_true")
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=database.engine)
+    db = database.SessionLocal()
+    try:
+        user = models.User(username=f"bench-{time.time_ns()}", email=f"{time.time_ns()}@bench.local", hashed_password="x")
+        db.add(user)
+        db.commit()
+        events = make_payload(args.events)
+
+        print(f"backend: {database.engine.dialect.name}+{database.engine.dialect.driver}")
+        created = []
+        bulk_time = timed("bulk", lambda: created.extend(bulk_path(db, user.id, events, args.chunk_size)), args.events)
+        check_response(created)
+        print(f"path: {'copy' if bulk.can_copy(db, args.events) else 'multi-row insert'}, response model ok")
+        if not args.skip_legacy:
+            legacy_time = timed("legacy", lambda: legacy_loop(db, user.id, events), args.events)
+            print(f"speedup: {legacy_time / bulk_time:.1f}x")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
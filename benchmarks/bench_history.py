@@ -0,0 +1,92 @@
+"""Storage and reconstruction cost of delta-encoded event history.
+
+Usage:
+    DATABASE_URL=postgresql://... python -m benchmarks.bench_history --versions 500 --interval 20
+
+Runs the same edit sequence with HISTORY_SNAPSHOT_INTERVAL=1 (a full copy per version, the old
+layout) and with the given interval. Without DATABASE_URL a throwaway SQLite file is used.
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+if not os.getenv("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+
+from app import database, models, versioning  # noqa: E402
+
+
+def payload_bytes(row):
+    size = sum(len(str(getattr(row, field))) for field in versioning.HISTORY_FIELDS if getattr(row, field) is not None)
+    if row.changes is not None:
+        size += len(json.dumps(row.changes))
+    return size
+
+
+def run(db, user_id, versions, interval, samples):
+    versioning.HISTORY_SNAPSHOT_INTERVAL = interval
+    start = datetime(2024, 1, 1, 9, 0)
+    event = models.Event(
+        title="Weekly sync", description="Agenda and notes. " * 400, start_time=start,
+        end_time=start + timedelta(hours=1), location="Room 1", creator_id=user_id,
+    )
+    db.add(event)
+    db.commit()
+
+    for i in range(versions):
+        new_values = versioning.event_state(event)
+        new_values["title"] = f"Weekly sync #{i}"
+        if i % 10 == 0:
+            new_values["description"] = event.description + f"\nEdit {i}"
+        versioning.record_change(db, event, new_values, user_id)
+        for attr, value in new_values.items():
+            setattr(event, attr, value)
+        db.commit()
+
+    rows = db.query(models.EventHistory).filter_by(event_id=event.id).all()
+    ids = [row.id for row in rows]
+    stored = sum(payload_bytes(row) for row in rows)
+
+    picks = [random.choice(ids) for _ in range(samples)]
+    started = time.perf_counter()
+    for version_id in picks:
+        versioning.rebuild(db, event.id, low_id=version_id, high_id=version_id)
+    rebuild_ms = (time.perf_counter() - started) / samples * 1000
+
+    started = time.perf_counter()
+    versioning.rebuild(db, event.id, low_id=0)
+    changelog_ms = (time.perf_counter() - started) * 1000
+    return stored, rebuild_ms, changelog_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--versions", type=int, default=500)
+    parser.add_argument("--interval", type=int, default=versioning.HISTORY_SNAPSHOT_INTERVAL)
+    parser.add_argument("--samples", type=int, default=200)
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=database.engine)
+    db = database.SessionLocal()
+    try:
+        user = models.User(username=f"bench-{time.time_ns()}", email=f"{time.time_ns()}@bench.local", hashed_password="x")
+        db.add(user)
+        db.commit()
+        print(f"backend: {database.engine.dialect.name}+{database.engine.dialect.driver}, {args.versions} versions")
+        print(f"{'interval':>8} {'stored KiB':>11} {'get_version ms':>15} {'changelog ms':>13}")
+        results = {}
+        for interval in (1, args.interval):
+            stored, rebuild_ms, changelog_ms = run(db, user.id, args.versions, interval, args.samples)
+            results[interval] = stored
+            print(f"{interval:>8} {stored / 1024:>11.1f} {rebuild_ms:>15.3f} {changelog_ms:>13.1f}")
+        print(f"storage reduction: {results[1] / results[args.interval]:.1f}x")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Compare the ORM + response_model read path with column projection + the fast encoder.
+
+Usage:
+    DATABASE_URL=postgresql://... python -m benchmarks.bench_read_path --events 5000 --page 500
+
+Times one page of GET /api/events and GET /api/events/{id}/permissions as the handlers build it:
+query, then serialization to JSON bytes. Without DATABASE_URL a throwaway SQLite file is used.
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+if not os.getenv("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+
+from app import bulk, database, models, schemas, serialization  # noqa: E402
+from app.events import EVENT_FIELDS  # noqa: E402
+from app.permissions import PERMISSION_FIELDS  # noqa: E402
+
+
+def seed(db, events, sharers):
+    stamp = time.time_ns()
+    users = [models.User(username=f"bench-{stamp}-{i}", email=f"{stamp}-{i}@bench.local", hashed_password="x") for i in range(sharers + 1)]
+    db.add_all(users)
+    db.commit()
+    owner = users[0]
+    start = datetime(2024, 1, 1, 9, 0)
+    payload = [
+        schemas.EventCreate(
+            title=f"Event {i}", description="Planning notes " * 20, start_time=start + timedelta(hours=i),
+            end_time=start + timedelta(hours=i, minutes=30), location="Room 1",
+        )
+        for i in range(events)
+    ]
+    created = bulk.create_events(db, owner.id, payload)
+    db.add_all(models.Permission(user_id=user.id, event_id=created[0].id, role="Viewer") for user in users[1:])
+    db.commit()
+    return owner.id, created[0].id
+
+
+def response_model_body(model, rows):
+    # What FastAPI does with a response_model: validate each ORM object, encode, json.dumps
+    return JSONResponse(jsonable_encoder([model.model_validate(row, from_attributes=True) for row in rows])).body
+
+
+def events_query(db, user_id, *columns):
+    return (
+        db.query(*columns)
+        .join(models.Permission, models.Permission.event_id == models.Event.id)
+        .filter(models.Permission.user_id == user_id)
+        .order_by(models.Event.start_time, models.Event.id)
+    )
+
+
+def legacy_events(db, user_id, page):
+    rows = events_query(db, user_id, models.Event).limit(page).all()
+    return response_model_body(schemas.EventOut, rows)
+
+
+def projected_events(db, user_id, page, fields):
+    columns = [models.Event.__table__.c[name] for name in fields]
+    rows = events_query(db, user_id, *columns).limit(page).all()
+    return serialization.dumps(serialization.project(rows, fields))
+
+
+def legacy_permissions(db, event_id):
+    rows = db.query(models.Permission).filter_by(event_id=event_id).all()
+    return response_model_body(schemas.PermissionOut, rows)
+
+
+def projected_permissions(db, event_id):
+    rows = db.query(*(models.Permission.__table__.c[name] for name in PERMISSION_FIELDS)).filter_by(event_id=event_id).all()
+    return serialization.dumps(serialization.project(rows, PERMISSION_FIELDS))
+
+
+def timed(label, fn, repeat):
+    db = database.SessionLocal()
+    try:
+        fn(db)
+        started = time.perf_counter()
+        for _ in range(repeat):
+            fn(db)
+            # A fresh request would start with an empty identity map
+            db.expunge_all()
+        elapsed = (time.perf_counter() - started) / repeat * 1000
+    finally:
+        db.close()
+    print(f"{label:<28} {elapsed:9.2f} ms/request")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--events", type=int, default=2000)
+    parser.add_argument("--page", type=int, default=500)
+    parser.add_argument("--sharers", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=database.engine)
+    db = database.SessionLocal()
+    try:
+        user_id, event_id = seed(db, args.events, args.sharers)
+    finally:
+        db.close()
+
+    print(f"backend: {database.engine.dialect.name}+{database.engine.dialect.driver}, encoder: {'orjson' if serialization.orjson else 'json'}")
+    legacy = timed("events (orm_mode)", lambda db: legacy_events(db, user_id, args.page), args.repeat)
+    projected = timed("events (projected)", lambda db: projected_events(db, user_id, args.page, EVENT_FIELDS), args.repeat)
+    sparse = timed("events (fields=id,title)", lambda db: projected_events(db, user_id, args.page, ["id", "title"]), args.repeat)
+    print(f"events speedup: {legacy / projected:.1f}x full, {legacy / sparse:.1f}x sparse")
+    legacy = timed("permissions (orm_mode)", lambda db: legacy_permissions(db, event_id), args.repeat)
+    projected = timed("permissions (projected)", lambda db: projected_permissions(db, event_id), args.repeat)
+    print(f"permissions speedup: {legacy / projected:.1f}x")
+
+
+if __name__ == "__main__":
+    main()